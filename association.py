@@ -0,0 +1,116 @@
+"""
+    Association scores of the n-grams in collocations_<field>.
+
+    Ranking by raw frequency puts combinations of function words ("of the", "in the") on top. The
+    scores below compare the observed frequency O of an n-gram with the frequency E expected if its
+    words were independent, E = N * f(w1)/N * ... * f(wn)/N, where f are the word frequencies of the
+    field (word_freq) and N is its number of tokens:
+
+        pmi             log2(O / E)
+        log_likelihood  2 * (O * ln(O / E) - (O - E)), negative when O < E (simple-ll, Evert 2008)
+        t_score         (O - E) / sqrt(O)
+        dice            n * O / (f(w1) + ... + f(wn))
+
+    An n-gram with a word missing from word_freq (the tables were built from different versions of
+    the books) has no marginal to compare with; its scores are NULL and it is left out of the
+    rankings by association.
+
+    build_association_scores() computes them with numpy over a whole table at once and writes them
+    to collocation_scores_<field> (keyed on the id of the n-gram), with an (n, score) index per
+    measure so the top n-grams by any measure are read in index order.
+
+    Usage (after search_index.py; preprocess.py runs it automatically):
+        python association.py [fields...]
+"""
+import sqlite3
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from columnar import FIELDS, load_table
+from db_pool import DB_PATH, enable_wal, fetch_frame
+from search_index import MEASURES, collocation_table, has_table, score_table
+
+
+def scores(ngrams, frequencies, word_freq):
+    """
+        :param ngrams: n元组（空格分隔的词）
+        :param frequencies: 对应的频数
+        :param word_freq: Series，词 -> 频数
+        :return: DataFrame，列为MEASURES；含有词表中没有的词的n元组为nan
+    """
+    observed = np.asarray(frequencies, dtype=np.float64)
+    total = float(word_freq.sum()) or 1.0
+    words = pd.Series(ngrams, dtype=object).str.split(' ', expand=True)
+    vocab = pd.Index(word_freq.index)
+    counts = np.append(word_freq.to_numpy(dtype=np.float64), np.nan)
+
+    n = np.zeros(len(observed))
+    log_expected = np.full(len(observed), np.log(total))
+    marginal_sum = np.zeros(len(observed))
+    missing = np.zeros(len(observed), dtype=bool)
+    for column in words.columns:
+        present = words[column].notna().to_numpy()
+        ids = vocab.get_indexer(words[column].fillna(''))
+        f = counts[ids]  # 不在词表中的词（ids为-1）取到最后的nan
+        missing |= present & np.isnan(f)
+        f = np.where(np.isnan(f), observed, np.maximum(f, observed))
+        n += present
+        log_expected += np.where(present, np.log(f) - np.log(total), 0.0)
+        marginal_sum += np.where(present, f, 0.0)
+
+    expected = np.exp(log_expected)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.log(observed / expected)
+        result = pd.DataFrame({
+            'pmi': ratio / np.log(2),
+            'log_likelihood': np.sign(observed - expected) * 2 * (observed * ratio - (observed - expected)),
+            't_score': (observed - expected) / np.sqrt(observed),
+            'dice': n * observed / marginal_sum,
+        })
+    result = result[list(MEASURES)].replace([np.inf, -np.inf], np.nan).fillna(0.0)
+    result[missing] = np.nan
+    return result
+
+
+def build_association_scores(connection, fields=FIELDS, log=print):
+    """
+        重新计算这些领域所有n元组的关联度
+        :param connection: 可写的数据库连接
+    """
+    for field in fields:
+        table = collocation_table(field)
+        if not has_table(connection, table):
+            continue
+        try:
+            word_freq = load_table('word_freq', field, columns=['word', 'freq'])
+        except FileNotFoundError:
+            continue
+        word_freq = word_freq.dropna(subset=['word']).groupby('word')['freq'].sum()
+        ngrams = fetch_frame(connection.execute(f"select id, ngram, n, frequency from {table}"))
+        result = scores(ngrams['ngram'], ngrams['frequency'], word_freq)
+
+        target = score_table(field)
+        connection.execute(f"drop table if exists {target}")
+        connection.execute(f"create table {target} (id integer primary key, n integer not null, "
+                           + ', '.join(f'{measure} real' for measure in MEASURES) + ")")
+        columns = [ngrams['id'].to_numpy().tolist(), ngrams['n'].to_numpy().tolist()] + \
+                  [result[measure].astype(object).where(result[measure].notna(), None).tolist()
+                   for measure in MEASURES]
+        connection.executemany(f"insert into {target} values ({', '.join('?' * (len(MEASURES) + 2))})",
+                               zip(*columns))
+        for measure in MEASURES:
+            connection.execute(f"create index {target}_{measure} on {target} (n, {measure} desc)")
+        connection.commit()
+        log(f'{target}: {len(ngrams)} rows')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute the association scores of the n-grams')
+    parser.add_argument('fields', nargs='*', default=list(FIELDS), help='fields to score (default: all)')
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+    with sqlite3.connect(args.db) as conn:
+        enable_wal(conn)
+        build_association_scores(conn, args.fields)
@@ -0,0 +1,336 @@
+"""
+    Benchmarks of every page's data path on synthetic corpora.
+
+    For each scale (1x, 10x, 100x by default) a synthetic corpus is written into a temporary directory
+    with the same writers as preprocess.py: the xlsx artifacts and their columnar copies, the sentence
+    workbooks, the n_grams_<field> tables, a feature table, the per-book count matrix and the SQLite
+    search indexes. The lookups of the pages are then run headlessly (queries.py and the chart
+    builders) with random arguments.
+
+    The number of books, sentences and tokens grows linearly with the scale; the vocabulary grows with
+    the square root of the scale (Heaps' law) and the distinct n-grams with scale ** 0.8, which also
+    keeps every word list below the xlsx row limit. The size of the 1x corpus is set with --books,
+    --sentences, --vocab and --ngrams.
+
+    Every scale runs in its own process so that its peak RSS is measured on its own. The peak is a
+    running maximum over the process, so it is reported once after the build and once at the end of
+    the scale; per operation only the change of the current RSS over its calls is reported (memory
+    it keeps, e.g. in the caches). The result is one JSON document: per scale the build time, size
+    and peak RSS in MB, and per operation the cold (first call) latency, p50/p95 of the warm calls
+    in ms, throughput in calls per second and the RSS growth in MB.
+
+    Usage:
+        python benchmark.py [--scales 1 10 100] [--iterations 50] [--fields Business History] [--output bench.json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+
+import numpy as np
+
+POS_TAGS = ['NN', 'NNS', 'NNP', 'JJ', 'VB', 'VBD', 'VBG', 'VBN', 'VBZ', 'RB', 'IN', 'DT', 'PRP', 'CC', 'CD', 'TO']
+LETTERS = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / 1024 / 1024, 1)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux返回KB，macOS返回字节
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def rss_mb():
+    """
+        :return: 当前进程现在占用的内存（MB），无法获取时为None
+    """
+    try:
+        import psutil
+    except ImportError:
+        try:
+            with open('/proc/self/statm') as f:
+                pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            return None
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024, 1)
+    return round(psutil.Process().memory_info().rss / 1024 / 1024, 1)
+
+
+def make_vocab(rng, size):
+    words = set()
+    while len(words) < size:
+        lengths = rng.integers(2, 13, size - len(words))
+        words.update(''.join(rng.choice(LETTERS, n)) for n in lengths)
+    return np.array(sorted(words), dtype=object)
+
+
+def zipf_probabilities(size, exponent=1.07):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+def synthesize(scale, fields, books=10, sentences=200, vocab=20000, ngrams=40000, seed=0, log=print):
+    """
+        在当前目录中生成一个合成语料库（所有文件的位置与真实语料库相同）
+        :return: {'books': [(领域, 书名)], 'words': 词表样本, 'sentences': 句子总数}
+    """
+    import sqlite3
+    import pandas as pd
+    import columnar
+    import association
+    import corpus_store
+    import preprocess
+    import search_index
+    from db_pool import DB_PATH, FEATURE_TABLES, enable_wal
+    from subcorpus import CountMatrix
+
+    rng = np.random.default_rng(seed)
+    n_books = max(1, int(books * scale))
+    n_vocab = int(vocab * scale ** 0.5)
+    n_ngrams = int(ngrams * scale ** 0.8)
+    words = make_vocab(rng, n_vocab)
+    probabilities = zipf_probabilities(n_vocab)
+    tags = rng.integers(0, len(POS_TAGS), (n_vocab, 2))
+
+    connection = sqlite3.connect(DB_PATH)
+    enable_wal(connection)
+    infos = {}
+    partials = []
+    all_books = []
+    for field in fields:
+        rng.shuffle(probabilities)
+        total = preprocess.empty_total()
+        titles = [f'{field} Synthetic Textbook {i + 1}' for i in range(n_books)]
+        names = preprocess.sheet_names(titles)
+        book_sentences = []
+        for title in titles:
+            lengths = rng.integers(8, 31, sentences)
+            ids = rng.choice(n_vocab, lengths.sum(), p=probabilities)
+            pos_ids = tags[ids, rng.integers(0, 2, len(ids))]
+            rows = []
+            start = 0
+            for length in lengths:
+                sen_words = words[ids[start:start + length]]
+                sen_tags = [POS_TAGS[t] for t in pos_ids[start:start + length]]
+                rows.append((' '.join(sen_words) + '.', str(list(zip(sen_words, sen_tags))), int(length)))
+                start += length
+            book_sentences.append((title, rows))
+
+            counts = np.bincount(ids, minlength=n_vocab)
+            book_words = Counter({words[i]: int(counts[i]) for i in np.flatnonzero(counts)})
+            book_pos = Counter(POS_TAGS[t] for t in pos_ids)
+            total['words'].update(book_words)
+            total['word_pos'].update(Counter(zip(words[ids], (POS_TAGS[t] for t in pos_ids))))
+            total['pos'].update(book_pos)
+            total['tokens'] += len(ids)
+            total['books'][title] = {'source': '', 'mtime': 0, 'size': 0, 'sheet': names[title],
+                                     'sentences': len(rows)}
+            partials.append((field, title, book_words, book_pos))
+            all_books.append((field, names[title]))
+
+        preprocess.write_word_artifacts(field, total)
+        preprocess.write_sentences(field, book_sentences, names)
+        n = rng.integers(2, 6, n_ngrams)
+        first = rng.choice(n_vocab, n_ngrams, p=probabilities)
+        grams = Counter()
+        for i, (length, head) in enumerate(zip(n, first)):
+            text = ' '.join([words[head]] + list(words[rng.integers(0, n_vocab, length - 1)]))
+            grams[(text, int(length))] += int(max(1, n_ngrams / (i + 1)))
+        preprocess.write_ngrams(connection, field, grams)
+        infos[field] = preprocess.field_info(total)
+        log(f'{field}: {n_books} books, {n_vocab} types, {total["tokens"]} tokens, {len(grams)} n-grams')
+
+    preprocess.write_summaries(infos)
+    CountMatrix.from_partials(partials).save()
+    for table in FEATURE_TABLES:
+        df = pd.DataFrame(rng.random((len(fields), 5)), columns=[f'{table}_{i}' for i in range(5)]).astype(str)
+        df.insert(0, 'field1', list(fields))
+        df.loc[len(df)] = ['Definition'] + [f'{table} feature {i}' for i in range(5)]
+        df.to_sql(table, connection, if_exists='replace', index=False)
+    columnar.compile_corpus(fields, log=lambda *args: None)
+    corpus_store.build_store(log=lambda *args: None)
+    search_index.build_word_index(connection, fields, log=lambda *args: None)
+    search_index.build_collocation_index(connection, fields, log=lambda *args: None)
+    association.build_association_scores(connection, fields, log=lambda *args: None)
+    search_index.build_sentence_index(connection, fields, log=lambda *args: None)
+    connection.close()
+    # 查询用的词按词频抽样，常用词被查到的机会更多
+    sample = np.unique(rng.choice(n_vocab, 2000, p=probabilities))
+    return {'books': all_books, 'words': list(words[sample]),
+            'types_per_field': n_vocab, 'books_per_field': n_books, 'sentences': len(all_books) * sentences}
+
+
+def measure(function, make_args, iterations):
+    """
+        :param function: 要测试的函数
+        :param make_args: 无参数函数，返回一次调用的参数元组
+        :return: {cold_ms, p50_ms, p95_ms, throughput, rss_growth_mb}
+    """
+    before = rss_mb()
+    start = time.perf_counter()
+    function(*make_args())
+    cold = time.perf_counter() - start
+    times = []
+    for _ in range(iterations):
+        args = make_args()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    times = np.array(times)
+    after = rss_mb()
+    return {
+        'cold_ms': round(cold * 1000, 3),
+        'p50_ms': round(float(np.percentile(times, 50)) * 1000, 3),
+        'p95_ms': round(float(np.percentile(times, 95)) * 1000, 3),
+        'throughput': round(len(times) / times.sum(), 1) if times.sum() else None,
+        'rss_growth_mb': round(after - before, 1) if before is not None and after is not None else None,
+    }
+
+
+def run_operations(corpus, fields, iterations, seed=0):
+    import plotly.express as px
+    import plotly.graph_objects as go
+    import queries
+    from data_cache import cached_summary, cached_table, ranked_table
+    from figures import line_trace
+    from keyness import compare
+    from subcorpus import load_matrix
+
+    rng = np.random.default_rng(seed + 1)
+    words = corpus['words']
+    books = corpus['books']
+
+    def field():
+        return fields[rng.integers(len(fields))]
+
+    def some_word():
+        return words[rng.integers(len(words))]
+
+    def field_books():
+        f = field()
+        own = [book for book_field, book in books if book_field == f]
+        return f, [own[i] for i in rng.choice(len(own), min(3, len(own)), replace=False)]
+
+    def substring_search(text):
+        f, chosen = field_books()
+        return queries.sentences(text, 'substring', field=f, books=chosen)
+
+    def cumulative_chart(f):
+        df = cached_table('cumulative_word_frequency', f).head(5000)
+        return go.Figure(line_trace(range(1, len(df) + 1), df['cumulative_freq'], text=df['word'])).to_json()
+
+    def word_freq_chart(f):
+        df = ranked_table('word_freq', f)[['word', 'freq']].head(100)
+        return px.bar(df, x='freq', y='word', orientation='h').to_json()
+
+    def subcorpus_stats():
+        matrix = load_matrix()
+        chosen = rng.choice(len(matrix.books), min(5, len(matrix.books)), replace=False)
+        return matrix.word_freq([matrix.books[i] for i in chosen])
+
+    operations = {
+        'overview.feature_table': (queries.feature_table, lambda: ('WoKF',)),
+        'word.basic_information': (queries.basic_information, lambda: (list(fields),)),
+        'word.lookup_all_fields': (queries.word, lambda: (some_word(), None)),
+        'word.frequency_page': (queries.word_frequencies,
+                                lambda: (field(), int(rng.integers(0, 20)), 50, 'rank', True, None)),
+        'word.frequency_filter': (queries.word_frequencies, lambda: (field(), 0, 50, 'word', True, some_word()[:2])),
+        'word.summary_cube': (cached_summary, lambda: (field(),)),
+        'word.chart_top_words': (word_freq_chart, lambda: (field(),)),
+        'word.chart_cumulative_5000': (cumulative_chart, lambda: (field(),)),
+        'subcorpus.word_freq': (subcorpus_stats, lambda: ()),
+        'keyness.field_vs_rest': (compare, lambda: (field(), None)),
+        'keyness.page': (queries.keywords, lambda: (field(), None, 'positive', 'log_ratio', int(rng.integers(0, 5)))),
+        'collocation.top20': (queries.collocations, lambda: (field(), some_word(), int(rng.integers(2, 5)), 20)),
+        'collocation.top20_short': (queries.collocations, lambda: (field(), some_word()[:2], 2, 20)),
+        'collocation.top20_pmi': (queries.collocations, lambda: (field(), some_word(), 2, 20, 'pmi', 3)),
+        'sentence.fts_token': (queries.sentences, lambda: (some_word(), 'token', field(), None, 0, 50)),
+        'sentence.fts_all_fields': (queries.sentences, lambda: (some_word(), 'token', None, None, 0, 50)),
+        'sentence.substring': (substring_search, lambda: (some_word(),)),
+    }
+    return {name: measure(function, make_args, iterations) for name, (function, make_args) in operations.items()}
+
+
+def run_scale(scale, fields, iterations, options):
+    """
+        在子进程中运行：生成一个规模的语料库并测试（当前目录为临时目录）
+    """
+    start = time.perf_counter()
+    corpus = synthesize(scale, fields, options.books, options.sentences, options.vocab, options.ngrams,
+                        log=lambda message: print(message, file=sys.stderr))
+    build_seconds = time.perf_counter() - start
+    build_peak = peak_rss_mb()
+    operations = run_operations(corpus, fields, iterations)
+    return {
+        'scale': scale,
+        'build_seconds': round(build_seconds, 2),
+        'books_per_field': corpus['books_per_field'],
+        'types_per_field': corpus['types_per_field'],
+        'sentences': corpus['sentences'],
+        'database_mb': round(os.path.getsize('corpora_data.db') / 1024 / 1024, 1),
+        'build_peak_rss_mb': build_peak,
+        'peak_rss_mb': peak_rss_mb(),
+        'operations': operations,
+    }
+
+
+def main():
+    from columnar import FIELDS
+
+    parser = argparse.ArgumentParser(description='Benchmark the data paths of the pages on synthetic corpora')
+    parser.add_argument('--scales', type=float, nargs='*', default=[1, 10, 100])
+    parser.add_argument('--iterations', type=int, default=50, help='warm calls per operation')
+    parser.add_argument('--fields', nargs='*', default=list(FIELDS), choices=FIELDS)
+    parser.add_argument('--books', type=int, default=10, help='books per field at 1x')
+    parser.add_argument('--sentences', type=int, default=200, help='sentences per book')
+    parser.add_argument('--vocab', type=int, default=20000, help='types per field at 1x')
+    parser.add_argument('--ngrams', type=int, default=40000, help='distinct n-grams per field at 1x')
+    parser.add_argument('--output', help='write the JSON result to this file instead of stdout')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic corpora')
+    parser.add_argument('--child', type=float, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child is not None:
+        json.dump(run_scale(options.child, options.fields, options.iterations, options), sys.stdout)
+        return
+
+    script = os.path.abspath(__file__)
+    results = []
+    for scale in options.scales:
+        workdir = tempfile.mkdtemp(prefix=f'corpus_bench_{scale:g}x_')
+        print(f'{scale:g}x: {workdir}', file=sys.stderr)
+        try:
+            command = [sys.executable, script, '--child', str(scale), '--iterations', str(options.iterations),
+                       '--books', str(options.books), '--sentences', str(options.sentences),
+                       '--vocab', str(options.vocab), '--ngrams', str(options.ngrams), '--fields'] + options.fields
+            # 子进程在临时目录中运行，页面模块的相对路径都指向合成语料库
+            output = subprocess.run(command, cwd=workdir, check=True, stdout=subprocess.PIPE).stdout
+            results.append(json.loads(output))
+        finally:
+            if not options.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    report = json.dumps({'python': sys.version.split()[0], 'iterations': options.iterations, 'results': results},
+                        indent=2)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+    Catalog of the books under .\\book.
+
+    The pages need the titles of each field, and used to walk the whole book directory on every rerun
+    to get them. The catalog keeps one entry per book (field, title, size, mtime and a SHA-1 of the
+    content) in .\\corpus_build\\catalog.json and an index of titles by field in memory, so a page
+    load never touches the file system.
+
+    The catalog is refreshed incrementally: a scan stats every file but only re-hashes the ones whose
+    size or mtime changed. A file that disappears or cannot be read during a scan is skipped (a locked
+    file keeps its previous entry) instead of stopping the scan. get_catalog() starts a watchdog
+    observer on the book directory that rescans once the directory has been quiet for
+    CORPUS_CATALOG_QUIET_SECONDS (default 2), so copying many books triggers a single scan; without
+    watchdog it rescans every CORPUS_CATALOG_SCAN_SECONDS (default 30).
+
+    Usage (print the catalog after a scan):
+        python catalog.py
+"""
+import os
+import json
+import hashlib
+import time
+import threading
+
+from columnar import FIELDS
+
+BOOK_DIR = os.path.join('.', 'book')
+CATALOG = os.path.join('.', 'corpus_build', 'catalog.json')
+SCAN_SECONDS = float(os.environ.get('CORPUS_CATALOG_SCAN_SECONDS', 30))
+QUIET_SECONDS = float(os.environ.get('CORPUS_CATALOG_QUIET_SECONDS', 2))
+
+
+def field_of(path, book_dir=BOOK_DIR):
+    parts = os.path.relpath(os.path.dirname(path), book_dir).split(os.sep)
+    return next((part for part in parts if part in FIELDS), None)
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BookCatalog:
+    def __init__(self, book_dir=BOOK_DIR, path=CATALOG):
+        self.book_dir = book_dir
+        self.path = path
+        self._books = {}  # relative path -> {field, title, size, mtime, sha1}
+        self._by_field = {}  # field -> [title]
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._watcher = None
+        self._timer = None
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self._set(json.load(f))
+
+    def _set(self, books):
+        by_field = {}
+        for entry in books.values():
+            by_field.setdefault(entry['field'], []).append(entry['title'])
+        with self._lock:
+            self._books = books
+            self._by_field = {field: sorted(titles) for field, titles in by_field.items()}
+
+    def _walk(self):
+        for roots, dirs, files in os.walk(self.book_dir):
+            for file in files:
+                path = os.path.join(roots, file)
+                if file.endswith('.txt') and field_of(path, self.book_dir) is not None:
+                    yield path
+
+    def scan(self):
+        """
+            对比book文件夹，只重新计算大小或修改时间变了的书的哈希值
+            :return: 有没有变化
+        """
+        with self._scan_lock:
+            old = self._books
+            books = {}
+            for path in self._walk():
+                key = os.path.relpath(path, self.book_dir)
+                entry = old.get(key)
+                try:
+                    stat = os.stat(path)
+                    if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+                        entry = {'field': field_of(path, self.book_dir), 'title': os.path.basename(path)[:-4],
+                                 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': file_hash(path)}
+                except FileNotFoundError:
+                    # 在遍历之后被删除
+                    continue
+                except OSError:
+                    # 被占用或没有权限：保留原来的记录，下次扫描再读取
+                    if entry is None:
+                        continue
+                books[key] = entry
+            if books == old:
+                return False
+            self._set(books)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(books, f, ensure_ascii=False, indent=2)
+            os.replace(self.path + '.tmp', self.path)
+            return True
+
+    def titles(self, field):
+        """
+            :return: 一个领域的所有书名（按书名排序）
+        """
+        with self._lock:
+            return list(self._by_field.get(field, []))
+
+    def books(self, field=None):
+        """
+            :return: [(领域, 书名, 路径)]
+        """
+        with self._lock:
+            entries = list(self._books.items())
+        return sorted((entry['field'], entry['title'], os.path.join(self.book_dir, key))
+                      for key, entry in entries if field is None or entry['field'] == field)
+
+    def watch(self):
+        """
+            在后台线程中保持目录更新：有watchdog时监听文件变化，否则定期扫描
+        """
+        if self._watcher is not None or not os.path.isdir(self.book_dir):
+            return
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            self._watcher = threading.Thread(target=self._poll, daemon=True)
+            self._watcher.start()
+            return
+
+        catalog = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if not event.is_directory:
+                    catalog._schedule()
+
+        self._watcher = Observer()
+        self._watcher.daemon = True
+        self._watcher.schedule(Handler(), self.book_dir, recursive=True)
+        self._watcher.start()
+
+    def _schedule(self):
+        # 合并连续的事件：目录安静QUIET_SECONDS之后才扫描一次
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(QUIET_SECONDS, self._safe_scan)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _safe_scan(self):
+        # 后台线程中的扫描出错时不能让线程退出，否则目录不再更新
+        try:
+            self.scan()
+        except Exception as e:
+            print(f'Book catalog scan failed: {type(e).__name__}: {e}')
+
+    def _poll(self):
+        while True:
+            time.sleep(SCAN_SECONDS)
+            self._safe_scan()
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+        进程内共享的BookCatalog：第一次调用时读取catalog.json并扫描一次，之后由后台线程保持更新
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = BookCatalog()
+            _catalog.scan()
+            _catalog.watch()
+        return _catalog
+
+
+if __name__ == '__main__':
+    catalog = BookCatalog()
+    catalog.scan()
+    for field, title, path in catalog.books():
+        print(f'{field}\t{title}\t{path}')
@@ -0,0 +1,336 @@
+"""
+    Columnar copies of the xlsx artifacts read by the pages.
+
+    compile_corpus() parses every xlsx file once and writes it as an uncompressed Arrow IPC file
+    under .\\columnar, keeping typed columns. load_table() memory-maps those files, so a page only
+    touches the columns and rows it asks for instead of re-parsing a workbook with openpyxl.
+
+    Usage (run again whenever the xlsx files change):
+        python columnar.py
+"""
+import os
+import re
+import json
+import argparse
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from diagnostics import span
+
+FIELDS = ('General', 'Business', 'Economics', 'History', 'Linguistics', 'Management', 'Media_communication',
+          'Philosophy', 'Psychology')
+
+COLUMNAR_DIR = os.path.join('.', 'columnar')
+MANIFEST = os.path.join(COLUMNAR_DIR, 'manifest.json')
+
+# artifact name -> (xlsx path, index_col); {field} is filled in for per-field artifacts
+ARTIFACTS = {
+    'word_freq': (os.path.join('.', 'word_freq', '{field}_word_frequencies.xlsx'), None),
+    'word_attribute': (os.path.join('.', 'word_attribute_pos_count', '{field}_word_attribute.xlsx'), None),
+    'pos_proportion': (os.path.join('.', 'pos_proportion', '{field}_pos_proportion.xlsx'), None),
+    'cumulative_word_frequency': (
+        os.path.join('.', 'cumulative_word_frequency', '{field}_cumulative_word_frequency.xlsx'), None),
+    'basic_information': (os.path.join('.', 'word_attribute', 'basic_information.xlsx'), 0),
+    'pos_full_name': (os.path.join('.', 'word_attribute_pos_count', 'pos_full_name.xlsx'), None),
+    'sentences_total_attribute': (os.path.join('.', 'sentences_attribute', 'sentences_total_attribute.xlsx'), None),
+}
+
+# field x word length x POS aggregates; pos_tag ALL_POS rows count each word once whatever its POS
+SUMMARY_CUBE = os.path.join(COLUMNAR_DIR, 'summary_cube', 'summary_cube.arrow')
+ALL_POS = '*'
+
+# multi-sheet workbook, one sheet per book
+SENTENCES_XLSX = os.path.join('.', 'sentences_attribute', '{field}_sentences_attribute.xlsx')
+
+_mmap_fs = fs.LocalFileSystem(use_mmap=True)
+
+
+def source_path(name, field=None):
+    return ARTIFACTS[name][0].format(field=field)
+
+
+def artifact_path(name, field=None):
+    filename = f'{field}_{name}.arrow' if field else f'{name}.arrow'
+    return os.path.join(COLUMNAR_DIR, name, filename)
+
+
+def sheet_file_name(sheet_name):
+    """
+        Excel sheet names may contain characters that are not valid in file names
+        :param sheet_name: 工作表名
+        :return: 对应的文件名
+    """
+    return re.sub(r'[^\w\-. ]', '_', sheet_name).strip() + '.arrow'
+
+
+def sentences_dir(field):
+    return os.path.join(COLUMNAR_DIR, 'sentences_attribute', field)
+
+
+def _typed(df):
+    # text columns hold str only (Excel turns words like "1990" or "true" into numbers/bools)
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def _read_xlsx(path, index_col=None, sheet_name=0):
+    # only empty cells are missing values, so words such as "null" and "nan" survive
+    return pd.read_excel(path, index_col=index_col, sheet_name=sheet_name, keep_default_na=False, na_values=[''])
+
+
+def _write(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(_typed(df), preserve_index=not isinstance(df.index, pd.RangeIndex))
+    tmp = path + '.tmp'
+    feather.write_feather(table, tmp, compression='uncompressed')
+    os.replace(tmp, path)
+
+
+def compile_artifact(name, field=None):
+    src = source_path(name, field)
+    if not os.path.exists(src):
+        return False
+    _write(_read_xlsx(src, index_col=ARTIFACTS[name][1]), artifact_path(name, field))
+    return True
+
+
+def write_artifact(name, df, field=None):
+    """
+        Write a frame that was just saved to its xlsx straight to the columnar file, without re-parsing the xlsx
+    """
+    _write(df.copy(), artifact_path(name, field))
+
+
+def update_sentence_sheets(field, added=None, removed=()):
+    """
+        书的工作表增加或删除后更新列式文件；其他书的文件内容没有变化，只更新修改时间使其仍然有效
+        :param field: 领域
+        :param added: {sheet name: DataFrame}
+        :param removed: 删除的工作表名
+    """
+    added = added or {}
+    manifest = _manifest()
+    if field not in manifest.get('sentences', {}):
+        # 这个领域还没有转换过，继续读取xlsx
+        return
+    sheets = manifest['sentences'][field]
+    target = sentences_dir(field)
+    for sheet_name in removed:
+        filename = sheets.pop(sheet_name, None)
+        if filename and os.path.exists(os.path.join(target, filename)):
+            os.remove(os.path.join(target, filename))
+    for filename in sheets.values():
+        path = os.path.join(target, filename)
+        if os.path.exists(path):
+            os.utime(path)
+    for sheet_name, df in added.items():
+        filename = sheet_file_name(sheet_name)
+        _write(df.copy(), os.path.join(target, filename))
+        sheets[sheet_name] = filename
+    os.makedirs(COLUMNAR_DIR, exist_ok=True)
+    with open(MANIFEST, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def compile_sentences(field):
+    """
+        把一个领域的多工作表句子文件一次性读入，每个工作表（每本书）写成一个文件
+        :param field: 领域
+        :return: {sheet name: file name}
+    """
+    src = SENTENCES_XLSX.format(field=field)
+    if not os.path.exists(src):
+        return {}
+    sheets = _read_xlsx(src, sheet_name=None)
+    target = sentences_dir(field)
+    written = {}
+    for sheet_name, df in sheets.items():
+        filename = sheet_file_name(sheet_name)
+        _write(df, os.path.join(target, filename))
+        written[sheet_name] = filename
+    return written
+
+
+def compile_corpus(fields=FIELDS, log=print):
+    """
+        Convert every xlsx artifact into a columnar file and write the manifest
+        :param fields: 需要转换的领域
+        :param log: 进度输出
+        :return: manifest
+    """
+    manifest = _manifest()
+    manifest.setdefault('sentences', {})
+    for name, (path, _) in ARTIFACTS.items():
+        for field in (fields if '{field}' in path else [None]):
+            if compile_artifact(name, field):
+                log(f'{name} {field or ""} -> {artifact_path(name, field)}')
+    build_summary_cube(fields, log=log)
+    for field in fields:
+        sheets = compile_sentences(field)
+        if sheets:
+            manifest['sentences'][field] = sheets
+            log(f'sentences_attribute {field}: {len(sheets)} books')
+    os.makedirs(COLUMNAR_DIR, exist_ok=True)
+    with open(MANIFEST, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def summary_rows(field, word_freq, word_attribute):
+    """
+        计算一个领域按词长和词性汇总的类符数（types）和形符数（tokens）
+        :param field: 领域
+        :param word_freq: word_freq表（word, freq）
+        :param word_attribute: word_attribute表（word, pos_tag, count）
+        :return: DataFrame，列为 field, word_lengths, pos_tag, types, tokens
+    """
+    words = word_freq.dropna(subset=['word'])
+    by_length = words.groupby(words['word'].str.len()).agg(types=('word', 'size'), tokens=('freq', 'sum'))
+    by_length = by_length.rename_axis('word_lengths').reset_index()
+    by_length['pos_tag'] = ALL_POS
+
+    pos = word_attribute.dropna(subset=['word', 'pos_tag'])
+    by_pos = pos.groupby([pos['word'].str.len().rename('word_lengths'), 'pos_tag']) \
+        .agg(types=('word', 'size'), tokens=('count', 'sum')).reset_index()
+
+    cube = pd.concat([by_length, by_pos], ignore_index=True)
+    cube.insert(0, 'field', field)
+    return cube.astype({'word_lengths': 'int32', 'types': 'int64', 'tokens': 'int64'})[
+        ['field', 'word_lengths', 'pos_tag', 'types', 'tokens']]
+
+
+def build_summary_cube(fields=FIELDS, log=print):
+    """
+        Recompute the summary cube rows of these fields and keep the rows of the other fields
+    """
+    parts = []
+    if os.path.exists(SUMMARY_CUBE):
+        old = _read_arrow(SUMMARY_CUBE)
+        parts.append(old[~old.field.isin(list(fields))])
+    for field in fields:
+        try:
+            word_freq = load_table('word_freq', field, columns=['word', 'freq'])
+            word_attribute = load_table('word_attribute', field, columns=['word', 'pos_tag', 'count'])
+        except FileNotFoundError:
+            continue
+        parts.append(summary_rows(field, word_freq, word_attribute))
+    if parts:
+        _write(pd.concat(parts, ignore_index=True), SUMMARY_CUBE)
+        log(f'summary_cube -> {SUMMARY_CUBE}')
+
+
+def summary_cube_is_fresh(field):
+    return all(_is_fresh(SUMMARY_CUBE, source_path(name, field)) for name in ('word_freq', 'word_attribute'))
+
+
+def load_summary_cube():
+    return _read_arrow(SUMMARY_CUBE)
+
+
+def _is_fresh(path, src):
+    if not os.path.exists(path):
+        return False
+    return not os.path.exists(src) or os.path.getmtime(path) >= os.path.getmtime(src)
+
+
+def _read_arrow(path, columns=None, where=None, limit=None):
+    dataset = ds.dataset(path, format='ipc', filesystem=_mmap_fs)
+    if limit is not None:
+        table = dataset.head(int(limit), columns=columns, filter=where)
+    else:
+        table = dataset.to_table(columns=columns, filter=where)
+    return table.to_pandas()
+
+
+def table_file(name, field=None):
+    """
+        The file load_table() reads for this artifact: the columnar file when it is up to date, else the xlsx
+    """
+    path = artifact_path(name, field)
+    return path if _is_fresh(path, source_path(name, field)) else source_path(name, field)
+
+
+def load_table(name, field=None, columns=None, where=None, limit=None):
+    """
+        读取一个artifact；有最新的列式文件时通过内存映射读取，否则退回读取xlsx
+        :param name: ARTIFACTS中的名字
+        :param field: 领域（每个领域一个文件的artifact）
+        :param columns: 只读取这些列
+        :param where: pyarrow.dataset表达式，例如 ds.field('pos_tag') == 'NN'
+        :param limit: 最多返回的行数
+        :return: DataFrame
+    """
+    src = source_path(name, field)
+    path = artifact_path(name, field)
+    if _is_fresh(path, src):
+        with span('load.arrow'):
+            return _read_arrow(path, columns, where, limit)
+
+    with span('load.xlsx'):
+        df = _typed(_read_xlsx(src, index_col=ARTIFACTS[name][1]))
+    if where is not None:
+        df = ds.dataset(pa.Table.from_pandas(df, preserve_index=True)).to_table(filter=where).to_pandas()
+    if columns is not None:
+        df = df[columns]
+    if limit is not None:
+        df = df.head(int(limit))
+    return df
+
+
+def _manifest():
+    if not os.path.exists(MANIFEST):
+        return {}
+    with open(MANIFEST, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def sentence_sheet_names(field):
+    src = SENTENCES_XLSX.format(field=field)
+    sheets = _manifest().get('sentences', {}).get(field)
+    if sheets and _is_fresh(MANIFEST, src):
+        return list(sheets)
+    return pd.ExcelFile(src).sheet_names
+
+
+def sentence_sheet_path(field, sheet_name):
+    """
+        The columnar file of one book sheet, or the workbook itself when that file is missing or stale
+    """
+    src = SENTENCES_XLSX.format(field=field)
+    path = os.path.join(sentences_dir(field), sheet_file_name(sheet_name))
+    return path if _is_fresh(path, src) else src
+
+
+def load_sentence_workbook(field):
+    """
+        一次读入一个领域的所有工作表
+        :param field: 领域
+        :return: DataFrame，多了一列book（工作表名）
+    """
+    with span('load.xlsx'):
+        sheets = _read_xlsx(SENTENCES_XLSX.format(field=field), sheet_name=None)
+    frames = [_typed(df).assign(book=sheet_name) for sheet_name, df in sheets.items()]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['book'])
+
+
+def load_sentence_sheet(field, sheet_name, columns=None):
+    src = SENTENCES_XLSX.format(field=field)
+    path = os.path.join(sentences_dir(field), sheet_file_name(sheet_name))
+    if _is_fresh(path, src):
+        with span('load.arrow'):
+            return _read_arrow(path, columns)
+    with span('load.xlsx'):
+        df = _typed(_read_xlsx(src, sheet_name=sheet_name))
+    return df if columns is None else df[columns]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile the xlsx corpus artifacts into columnar files')
+    parser.add_argument('fields', nargs='*', default=list(FIELDS), help='fields to compile (default: all)')
+    args = parser.parse_args()
+    compile_corpus(args.fields)
@@ -0,0 +1,382 @@
+"""
+    Compact read-only copy of the word and sentence data, shared by all processes through the page cache.
+
+    Every Streamlit worker that reads the word and sentence tables into pandas holds its own object
+    columns (one Python str per cell), so memory grows by about one corpus per worker. build_store()
+    writes the same data as flat files that each worker memory-maps, so the operating system keeps a
+    single copy of the pages for all of them:
+
+        vocab.bin, vocab_offsets.npy    every word of the corpus once (sorted, utf-8, NUL-separated);
+                                        everywhere else a word is its int32 position in this list
+        vocab_lengths.npy               the length of each word
+        tags.json                       the POS tags; a POS is its uint8 position in this list
+        <field>/word_freq_*.npy         word ids and frequencies, in rank order
+        <field>/word_attribute_*.npy    word ids, POS codes and counts
+        <field>/sentences.bin, tagged.bin (+ _offsets.npy), sentence_book.npy, books.json
+
+    Strings are decoded only for the rows a query returns; substring searches run over the mapped
+    bytes. Each build goes to a new version directory and current.json is switched to it last, so
+    workers can keep reading the previous version until they notice the new one.
+
+    Usage (preprocess.py runs it after compiling the columnar files):
+        python corpus_store.py
+"""
+import os
+import re
+import json
+import mmap
+import time
+import shutil
+import bisect
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+from columnar import FIELDS, SENTENCES_XLSX, load_sentence_sheet, load_table, sentence_sheet_names, table_file
+from diagnostics import span
+from paged_table import PAGE_SIZE
+
+STORE_DIR = os.path.join('.', 'corpus_store')
+CURRENT = os.path.join(STORE_DIR, 'current.json')
+SEPARATOR = b'\x00'
+
+
+def _sources(field):
+    paths = [table_file('word_freq', field), table_file('word_attribute', field), SENTENCES_XLSX.format(field=field)]
+    return {path: os.path.getmtime(path) for path in paths if os.path.exists(path)}
+
+
+def _write_strings(path, strings):
+    data = [s.encode('utf-8') + SEPARATOR for s in strings]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in data], out=offsets[1:])
+    with open(path + '.bin', 'wb') as f:
+        f.write(b''.join(data))
+    np.save(path + '_offsets.npy', offsets)
+
+
+def _words(df, column='word'):
+    return df[column].dropna().astype(str)
+
+
+def build_store(log=print):
+    """
+        重新生成FIELDS中所有领域的存储
+        （词表是全部领域共用的，current.json也只列出这次生成的领域，所以总是一起生成）
+        :return: 新版本的文件夹
+    """
+    sources = {field: _sources(field) for field in FIELDS}
+    frames = {}
+    for field in FIELDS:
+        try:
+            word_freq = load_table('word_freq', field, columns=['word', 'freq'])
+            word_attribute = load_table('word_attribute', field, columns=['word', 'pos_tag', 'count'])
+        except FileNotFoundError:
+            continue
+        word_freq = word_freq.dropna(subset=['word']).sort_values('freq', ascending=False, kind='stable')
+        frames[field] = (word_freq, word_attribute.dropna(subset=['word', 'pos_tag']))
+    vocab = sorted(set().union(*(set(_words(wf)) | set(_words(wa)) for wf, wa in frames.values())))
+    tags = sorted(set().union(*(set(_words(wa, 'pos_tag')) for _, wa in frames.values())))
+    if len(tags) > 255:
+        raise ValueError(f'Too many POS tags for uint8 codes: {len(tags)}')
+    vocab_index = pd.Index(vocab)
+    tag_index = pd.Index(tags)
+
+    version = os.path.join(STORE_DIR, f'v{time.time_ns()}')
+    os.makedirs(version)
+    _write_strings(os.path.join(version, 'vocab'), vocab)
+    np.save(os.path.join(version, 'vocab_lengths.npy'), np.array([len(w) for w in vocab], dtype=np.int32))
+    with open(os.path.join(version, 'tags.json'), 'w', encoding='utf-8') as f:
+        json.dump(tags, f, ensure_ascii=False)
+
+    built = {}
+    for field, (word_freq, word_attribute) in frames.items():
+        target = os.path.join(version, field)
+        os.makedirs(target)
+        np.save(os.path.join(target, 'word_freq_word.npy'),
+                vocab_index.get_indexer(word_freq['word'].astype(str)).astype(np.int32))
+        np.save(os.path.join(target, 'word_freq_freq.npy'), word_freq['freq'].to_numpy(dtype=np.int64))
+        np.save(os.path.join(target, 'word_attribute_word.npy'),
+                vocab_index.get_indexer(word_attribute['word'].astype(str)).astype(np.int32))
+        np.save(os.path.join(target, 'word_attribute_pos.npy'),
+                tag_index.get_indexer(word_attribute['pos_tag'].astype(str)).astype(np.uint8))
+        np.save(os.path.join(target, 'word_attribute_count.npy'), word_attribute['count'].to_numpy(dtype=np.int64))
+
+        try:
+            books = sentence_sheet_names(field)
+        except FileNotFoundError:
+            books = []
+        # 没有句子的行不保存（与sentence_store中str.contains(..., na=False)的结果一致）
+        sheets = [load_sentence_sheet(field, book, columns=['sentences', 'tagged']).dropna(subset=['sentences'])
+                  for book in books]
+        sentences = pd.concat(sheets, ignore_index=True) if sheets else pd.DataFrame(columns=['sentences', 'tagged'])
+        _write_strings(os.path.join(target, 'sentences'), sentences['sentences'].astype(str))
+        _write_strings(os.path.join(target, 'tagged'), sentences['tagged'].fillna('').astype(str))
+        np.save(os.path.join(target, 'sentence_book.npy'),
+                np.repeat(np.arange(len(books), dtype=np.int32), [len(df) for df in sheets]))
+        with open(os.path.join(target, 'books.json'), 'w', encoding='utf-8') as f:
+            json.dump(books, f, ensure_ascii=False)
+        built[field] = {'sources': sources[field], 'words': len(word_freq), 'sentences': len(sentences)}
+        log(f'{field}: {len(word_freq)} words, {len(sentences)} sentences')
+
+    previous = _current().get('version')
+    tmp = CURRENT + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'version': os.path.basename(version), 'fields': built}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, CURRENT)
+    # 保留上一个版本给还没有切换的进程，更早的版本删除（仍被映射时在Windows上删除失败，下次再删）
+    for name in os.listdir(STORE_DIR):
+        path = os.path.join(STORE_DIR, name)
+        if os.path.isdir(path) and name not in (os.path.basename(version), previous):
+            shutil.rmtree(path, ignore_errors=True)
+    log(f'corpus store: {len(vocab)} words, {len(tags)} POS tags -> {version}')
+    return version
+
+
+def _current():
+    if not os.path.exists(CURRENT):
+        return {}
+    with open(CURRENT, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Strings:
+    """
+        内存映射的字符串列：只在取出时解码
+    """
+
+    def __init__(self, path):
+        self.data = _map(path + '.bin')
+        self.offsets = np.load(path + '_offsets.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1] - 1].decode('utf-8')
+
+    def take(self, ids):
+        """
+            :return: ndarray（object），ids对应的字符串
+        """
+        return np.array([self[i] for i in np.asarray(ids, dtype=np.int64)], dtype=object)
+
+    def search(self, text, ignore_case=False):
+        """
+            查找包含text的字符串（忽略大小写时只忽略ASCII字母的大小写）
+            :return: 编号（从小到大）
+        """
+        pattern = re.compile(re.escape(text.encode('utf-8')), re.IGNORECASE if ignore_case else 0)
+        starts = np.fromiter((m.start() for m in pattern.finditer(self.data)), dtype=np.int64)
+        # 分隔符不会出现在text中，所以一个匹配不会跨过两个字符串
+        return np.unique(np.searchsorted(self.offsets, starts, side='right') - 1)
+
+    def find(self, text):
+        """
+            在排好序的字符串中二分查找
+            :return: 编号，不存在时为None
+        """
+        i = bisect.bisect_left(range(len(self)), text, key=self.__getitem__) if len(self) else 0
+        return i if i < len(self) and self[i] == text else None
+
+
+class WordFreqView:
+    """
+        一个领域的词频表筛选、排序后的结果（只保存行号）
+    """
+
+    def __init__(self, store, field, positions):
+        self.store = store
+        self.field = field
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def page(self, page=0, page_size=PAGE_SIZE):
+        """
+            :return: DataFrame，列为 word, freq, word_lengths，索引为名次（rank）
+        """
+        return self.store.word_freq_rows(self.field, self.positions[page * page_size:(page + 1) * page_size])
+
+    def locate(self, target):
+        """
+            数字按名次查找，其他按词查找
+            :return: 在结果中的位置，找不到时返回None
+        """
+        target = str(target).strip()
+        if target.isdigit():
+            hits = np.flatnonzero(self.positions == int(target) - 1)
+        else:
+            word_id = self.store.vocab.find(target)
+            if word_id is None:
+                return None
+            hits = np.flatnonzero(self.store.array(self.field, 'word_freq_word')[self.positions] == word_id)
+        return int(hits[0]) if len(hits) else None
+
+
+class CorpusStore:
+    def __init__(self, version, fields):
+        self.path = os.path.join(STORE_DIR, version)
+        self.fields = fields
+        self.vocab = Strings(os.path.join(self.path, 'vocab'))
+        self.vocab_lengths = np.load(os.path.join(self.path, 'vocab_lengths.npy'), mmap_mode='r')
+        with open(os.path.join(self.path, 'tags.json'), encoding='utf-8') as f:
+            self.tags = json.load(f)
+        self._opened = {}
+        self._lock = threading.Lock()
+
+    def is_fresh(self, field):
+        """
+            :return: 这个领域的数据在生成之后没有变化
+        """
+        entry = self.fields.get(field)
+        return entry is not None and _sources(field) == entry['sources']
+
+    def _open(self, field, name, opener):
+        key = (field, name)
+        value = self._opened.get(key)
+        if value is None:
+            with self._lock, span('load.store'):
+                value = self._opened.get(key)
+                if value is None:
+                    value = self._opened[key] = opener(os.path.join(self.path, field, name))
+        return value
+
+    def array(self, field, name):
+        return self._open(field, name, lambda path: np.load(path + '.npy', mmap_mode='r'))
+
+    def strings(self, field, name):
+        return self._open(field, name, Strings)
+
+    def books(self, field):
+        def read(path):
+            with open(path + '.json', encoding='utf-8') as f:
+                return json.load(f)
+        return self._open(field, 'books', read)
+
+    def word_freq_rows(self, field, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        ids = self.array(field, 'word_freq_word')[positions]
+        df = pd.DataFrame({'word': self.vocab.take(ids), 'freq': self.array(field, 'word_freq_freq')[positions],
+                           'word_lengths': self.vocab_lengths[ids]}, index=pd.Index(positions + 1, name='rank'))
+        return df
+
+    def word_freq(self, field, sort_by='rank', ascending=True, contains=None):
+        """
+            与paged_table.view(ranked_table('word_freq', field), ...)相同的筛选和排序
+            :param sort_by: rank, word, freq 或 word_lengths
+            :param contains: 只保留包含该字符串的词（忽略大小写）
+            :return: WordFreqView
+        """
+        ids = self.array(field, 'word_freq_word')
+        positions = np.arange(len(ids))
+        if contains:
+            positions = positions[np.isin(ids, self.vocab.search(contains, ignore_case=True))]
+        # 词表是排好序的，所以按词排序就是按词的编号排序
+        keys = {'word': ids, 'freq': self.array(field, 'word_freq_freq'), 'word_lengths': self.vocab_lengths[ids]}
+        if sort_by in keys:
+            key = np.asarray(keys[sort_by][positions])
+            positions = positions[np.argsort(key if ascending else -key, kind='stable')]
+        elif sort_by == 'rank' and not ascending:
+            positions = positions[::-1]
+        return WordFreqView(self, field, positions)
+
+    def word_attribute(self, field, pos=None, limit=None):
+        """
+            :param pos: 只保留这个词性的词
+            :return: DataFrame，列为 word, pos_tag, count
+        """
+        codes = self.array(field, 'word_attribute_pos')
+        positions = np.arange(len(codes))
+        if pos is not None:
+            positions = np.flatnonzero(codes == self.tags.index(pos)) if pos in self.tags else positions[:0]
+        positions = positions[:limit]
+        return pd.DataFrame({'word': self.vocab.take(self.array(field, 'word_attribute_word')[positions]),
+                             'pos_tag': np.array(self.tags, dtype=object)[codes[positions]],
+                             'count': self.array(field, 'word_attribute_count')[positions]})
+
+    def lookup(self, word, fields):
+        """
+            :return: DataFrame，列为 word, pos_tag, count, field
+        """
+        word_id = self.vocab.find(word)
+        frames = []
+        for field in fields:
+            if word_id is None or field not in self.fields:
+                continue
+            positions = np.flatnonzero(self.array(field, 'word_attribute_word') == word_id)
+            frames.append(pd.DataFrame({'word': word, 'field': field,
+                                        'pos_tag': np.array(self.tags, dtype=object)[
+                                            self.array(field, 'word_attribute_pos')[positions]],
+                                        'count': self.array(field, 'word_attribute_count')[positions]}))
+        if not frames:
+            return pd.DataFrame(columns=['word', 'pos_tag', 'count', 'field'])
+        return pd.concat(frames, ignore_index=True)[['word', 'pos_tag', 'count', 'field']]
+
+    def cumulative_word_frequency(self, field, limit=None):
+        """
+            :return: DataFrame，列为 word, freq, cumulative_freq（按频数从高到低）
+        """
+        freq = np.asarray(self.array(field, 'word_freq_freq')[:limit])
+        ids = self.array(field, 'word_freq_word')[:len(freq)]
+        return pd.DataFrame({'word': self.vocab.take(ids), 'freq': freq, 'cumulative_freq': np.cumsum(freq)})
+
+    def sentences(self, field, text, books=None, page=0, page_size=PAGE_SIZE):
+        """
+            在所选的书中查找包含text的句子（区分大小写）
+            :param books: 工作表名列表，None表示这个领域的所有书
+            :return: (DataFrame，列为 sentences, tagged, book；符合条件的句子总数)
+        """
+        sentences = self.strings(field, 'sentences')
+        hits = sentences.search(text) if text else np.arange(len(sentences))
+        names = self.books(field)
+        book = self.array(field, 'sentence_book')
+        if books is not None:
+            hits = hits[np.isin(book[hits], [names.index(b) for b in books if b in names])]
+        shown = hits[page * page_size:(page + 1) * page_size]
+        df = pd.DataFrame({'sentences': sentences.take(shown), 'tagged': self.strings(field, 'tagged').take(shown),
+                           'book': np.array(names, dtype=object)[book[shown]] if len(names) else []})
+        return df, len(hits)
+
+
+_loaded = {}
+_load_lock = threading.Lock()
+
+
+def open_store():
+    """
+        进程内共享的CorpusStore，生成新版本后重新打开；还没有生成时返回None
+    """
+    if not os.path.exists(CURRENT):
+        return None
+    mtime = os.path.getmtime(CURRENT)
+    with _load_lock:
+        if _loaded.get('mtime') != mtime:
+            current = _current()
+            _loaded['store'] = CorpusStore(current['version'], current['fields'])
+            _loaded['mtime'] = mtime
+        return _loaded['store']
+
+
+def field_store(field):
+    """
+        :return: 这个领域的数据是最新的时返回CorpusStore，否则返回None（调用方退回读取表格）
+    """
+    store = open_store()
+    return store if store is not None and store.is_fresh(field) else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the shared memory-mapped corpus store')
+    parser.parse_args()
+    build_store()
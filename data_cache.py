@@ -0,0 +1,165 @@
+"""
+    Process-wide cache for the per-field tables used by the pages.
+
+    Streamlit reruns the page script for every widget change and every user session runs its own
+    script thread, but imported modules live for the whole process, so a cache kept here is shared by
+    all of them. Entries are keyed on file path plus modification time, so a rebuilt file is picked up
+    on the next read, and the least recently used entries are evicted once the memory limit is reached.
+
+    prefetch() starts loads on a small thread pool (CORPUS_LOAD_THREADS, default 4) so the tables of
+    several fields are read at the same time; a page that asks for a table while it is still loading
+    waits for that load instead of reading the file again.
+
+    The limit is set in MB with the CORPUS_CACHE_MB environment variable (default 512).
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import columnar
+import diagnostics
+from paged_table import rank_ordered
+
+
+def _frame_size(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class DataCache:
+    def __init__(self, limit_mb=512):
+        self.limit = int(limit_mb * 1024 * 1024)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (mtime, value, size)
+        self._loading = {}  # key -> (mtime, Future)，正在读取的数据
+        self._lock = threading.Lock()
+
+    def get(self, path, loader, key=None):
+        """
+            取缓存；文件修改时间变了或不在缓存中时调用loader重新读取。
+            另一个线程正在读取同一数据时等待它的结果，不重复读取
+            :param path: 数据文件路径
+            :param loader: 无参数函数，返回DataFrame
+            :param key: 由同一个文件得到的不同数据用不同的key（默认为path）
+            :return: DataFrame（共享对象，调用方不要原地修改）
+        """
+        key = key or path
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                diagnostics.count('data_cache.hit')
+                return entry[1]
+            loading = self._loading.get(key)
+            if loading is not None and loading[0] == mtime:
+                self.hits += 1
+                diagnostics.count('data_cache.hit')
+                future = loading[1]
+            else:
+                self.misses += 1
+                diagnostics.count('data_cache.miss')
+                future = None
+                loading = (mtime, Future())
+                self._loading[key] = loading
+        if future is not None:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            with self._lock:
+                if self._loading.get(key) is loading:
+                    del self._loading[key]
+            loading[1].set_exception(e)
+            raise
+        size = _frame_size(value)
+        with self._lock:
+            if self._loading.get(key) is loading:
+                del self._loading[key]
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            if size <= self.limit:
+                self._entries[key] = (mtime, value, size)
+                self.size += size
+                while self.size > self.limit:
+                    _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                    self.size -= evicted_size
+                    self.evictions += 1
+        loading[1].set_result(value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size_mb': round(self.size / 1024 / 1024, 2),
+                'limit_mb': round(self.limit / 1024 / 1024, 2),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+cache = DataCache(float(os.environ.get('CORPUS_CACHE_MB', 512)))
+diagnostics.register_stats('data_cache', cache.stats)
+_loader = ThreadPoolExecutor(int(os.environ.get('CORPUS_LOAD_THREADS', 4)), thread_name_prefix='data_cache')
+
+
+def prefetch(calls):
+    """
+        在后台线程中同时执行这些读取，结果留在缓存中；页面之后按顺序调用时直接命中或等待正在进行的读取
+        :param calls: [(函数, 参数...)]，如 (cached_table, 'word_freq', 'Business')
+        :return: [Future]
+    """
+    # 在后台线程中读取的耗时仍然记在提交它的页面下
+    page = diagnostics.current_page()
+    return [_loader.submit(_in_page, page, call[0], *call[1:]) for call in calls]
+
+
+def _in_page(page, function, *args):
+    with diagnostics.page_context(page):
+        return function(*args)
+
+
+def cached_table(name, field=None):
+    """
+        读取一个artifact的全部数据，同一个文件在进程内只读取一次
+        :param name: columnar.ARTIFACTS中的名字
+        :param field: 领域
+        :return: DataFrame（共享对象，调用方不要原地修改）
+    """
+    return cache.get(columnar.table_file(name, field), lambda: columnar.load_table(name, field))
+
+
+def cached_summary(field):
+    """
+        一个领域的汇总数据（见columnar.summary_rows）；summary cube不存在或过期时由该领域的数据计算
+        :param field: 领域
+        :return: DataFrame，列为 field, word_lengths, pos_tag, types, tokens
+    """
+    if columnar.summary_cube_is_fresh(field):
+        cube = cache.get(columnar.SUMMARY_CUBE, columnar.load_summary_cube)
+        rows = cube[cube.field == field]
+        if len(rows):
+            return rows
+    return columnar.summary_rows(field, cached_table('word_freq', field), cached_table('word_attribute', field))
+
+
+def ranked_table(name, field=None, by='freq'):
+    """
+        按by从高到低排好序的artifact，索引为名次（rank，从1开始）；排序只在文件更新后做一次
+        :return: DataFrame（共享对象，调用方不要原地修改）
+    """
+    path = columnar.table_file(name, field)
+    return cache.get(path, lambda: rank_ordered(cached_table(name, field), by), key=f'{path}#rank:{by}')
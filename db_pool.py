@@ -0,0 +1,137 @@
+"""
+    Read-only SQLite connections for the pages.
+
+    Every Streamlit session runs its script in its own thread, so the pages must not share one
+    connection. ReadPool hands each thread a read-only connection of its own for the duration of a
+    query and keeps the idle ones for the next rerun. The connections map the database file into
+    memory and cache their prepared statements; the writers (search_index.py, preprocess.py) switch the
+    database to WAL so that readers are not blocked while a book is being added.
+
+    fetch_frame() reads query results in chunks and turns each column into a typed numpy array (int64,
+    float64 or object), so a large n_grams_<field> result is never held as a list of row lists.
+
+    Table names cannot be bound as parameters; check_table() only lets through the tables built by
+    this project.
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from columnar import FIELDS
+from diagnostics import span
+
+DB_PATH = "corpora_data.db"
+FEATURE_TABLES = ('WoKF', 'EnDF', 'PhrF', 'TrSF', 'POSF', 'TTRF', 'PsyF', 'ShaF', 'TraF')
+TABLES = frozenset(FEATURE_TABLES + ('word_index', 'sentences_fts', 'sentence_features', 'book_sentence_features',
+                                     'field_sentence_features')
+                   + tuple(f'n_grams_{field}' for field in FIELDS)
+                   + tuple(f'collocations_{field}' for field in FIELDS)
+                   + tuple(f'collocation_scores_{field}' for field in FIELDS))
+
+MMAP_SIZE = 256 * 1024 * 1024
+CHUNK_ROWS = 10000
+
+
+def check_table(name):
+    if name not in TABLES:
+        raise ValueError(f'Unknown table: {name}')
+    return name
+
+
+def enable_wal(connection):
+    """
+        把数据库切换到WAL模式（写入的一方执行一次即可，之后读写互不阻塞）
+    """
+    connection.execute("pragma journal_mode=wal")
+
+
+def _array(values):
+    first = next((v for v in values if v is not None), None)
+    if isinstance(first, int) and all(type(v) is int for v in values):
+        return np.fromiter(values, dtype=np.int64, count=len(values))
+    if isinstance(first, (int, float)) and all(v is None or isinstance(v, (int, float)) for v in values):
+        return np.array(values, dtype=np.float64)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def fetch_frame(cursor, chunk_rows=CHUNK_ROWS):
+    """
+        按列读取查询结果
+        :param cursor: 已执行查询的cursor
+        :return: DataFrame，每列为一个numpy数组
+    """
+    names = [description[0] for description in cursor.description]
+    chunks = [[] for _ in names]
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+        for chunk, values in zip(chunks, zip(*rows)):
+            chunk.append(_array(values))
+    columns = {}
+    for name, chunk in zip(names, chunks):
+        if not chunk:
+            columns[name] = np.empty(0, dtype=object)
+        elif any(array.dtype == object for array in chunk):
+            columns[name] = np.concatenate([array.astype(object) for array in chunk])
+        else:
+            columns[name] = np.concatenate(chunk)
+    return pd.DataFrame(columns, columns=names, copy=False)
+
+
+class ReadPool:
+    def __init__(self, path=DB_PATH, size=8):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def _open(self):
+        connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False,
+                                     cached_statements=256)
+        connection.execute("pragma query_only=1")
+        connection.execute(f"pragma mmap_size={MMAP_SIZE}")
+        connection.execute("pragma temp_store=memory")
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """
+            取一个空闲的只读连接，用完后放回（同一时间一个连接只被一个线程使用）
+        """
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = self._open()
+        try:
+            yield connection
+        finally:
+            with self._lock:
+                if self._idle.qsize() < self.size:
+                    self._idle.put(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+
+    def run(self, function, *args, **kwargs):
+        """
+            用一个连接调用function(connection, *args, **kwargs)，如search_index.lookup_word
+        """
+        with self.connection() as connection, span(f'sqlite.{function.__name__}'):
+            return function(connection, *args, **kwargs)
+
+    def read_sql(self, sql, params=()):
+        with self.connection() as connection, span('sqlite.read_sql'):
+            return fetch_frame(connection.execute(sql, params))
+
+    def read_table(self, name):
+        return self.read_sql(f"select * from {check_table(name)}")
+
+
+pool = ReadPool()
@@ -0,0 +1,150 @@
+"""
+    Timing spans and counters for the hot paths.
+
+    with span('sqlite.top_collocations'): ... records how long the block took in a histogram per
+    (page, span). The page is the one the current script thread is running (set by index.py with
+    page_context); data_cache.prefetch() carries the page over to its loader threads, and other
+    background work is recorded under 'background'. The spans in use:
+
+        load.arrow / load.xlsx      columnar.load_table and the sentence sheets
+        load.store                  mapping a file of the corpus store (corpus_store.py)
+        sqlite.<function>           queries run through db_pool
+        model.<backend>             nlp_service batches
+        figure.build                figures.FigureCache misses
+        page.run                    a whole page script run
+
+    count() keeps plain counters (data_cache, figure_cache and wordcloud_cache hits and misses), and
+    register_stats() adds the stats of other components (e.g. the data cache) to every snapshot.
+    snapshot() returns everything as a dict for JSON, prometheus() renders it in the Prometheus text
+    format.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+# 直方图的上界（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+_spans = {}  # (page, span) -> {'count', 'sum', 'max', 'buckets'}
+_counters = {}  # (page, name) -> int
+_stats = {}  # name -> 无参数函数，返回{key: number}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def current_page():
+    return getattr(_local, 'page', None) or 'background'
+
+
+@contextmanager
+def page_context(page):
+    previous = getattr(_local, 'page', None)
+    _local.page = page
+    try:
+        yield
+    finally:
+        _local.page = previous
+
+
+def record(name, seconds, page=None):
+    key = (page or current_page(), name)
+    with _lock:
+        entry = _spans.get(key)
+        if entry is None:
+            entry = _spans[key] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(BUCKETS)}
+        entry['count'] += 1
+        entry['sum'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                entry['buckets'][i] += 1
+                break
+
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def count(name, n=1):
+    key = (current_page(), name)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def register_stats(name, function):
+    _stats[name] = function
+
+
+def _quantile(entry, q):
+    target = q * entry['count']
+    seen = 0
+    for bound, n in zip(BUCKETS, entry['buckets']):
+        seen += n
+        if seen >= target:
+            return min(bound, entry['max'])
+    return entry['max']
+
+
+def snapshot():
+    """
+        :return: {'spans': [...], 'counters': [...], 'stats': {...}}；时间单位为毫秒
+    """
+    with _lock:
+        spans = [{'page': page, 'span': name, 'count': e['count'], 'total_ms': round(e['sum'] * 1000, 3),
+                  'mean_ms': round(e['sum'] / e['count'] * 1000, 3), 'p50_ms': round(_quantile(e, 0.5) * 1000, 3),
+                  'p95_ms': round(_quantile(e, 0.95) * 1000, 3), 'max_ms': round(e['max'] * 1000, 3),
+                  'buckets': dict(zip([str(b) for b in BUCKETS], e['buckets']))}
+                 for (page, name), e in sorted(_spans.items())]
+        counters = [{'page': page, 'name': name, 'value': value} for (page, name), value in sorted(_counters.items())]
+    stats = {}
+    for name, function in list(_stats.items()):
+        try:
+            stats[name] = function()
+        except Exception as e:
+            stats[name] = {'error': str(e)}
+    return {'spans': spans, 'counters': counters, 'stats': stats}
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus():
+    """
+        :return: Prometheus text format
+    """
+    lines = ['# HELP corpus_span_seconds Duration of instrumented operations.',
+             '# TYPE corpus_span_seconds histogram']
+    with _lock:
+        spans = sorted((key, dict(e, buckets=list(e['buckets']))) for key, e in _spans.items())
+        counters = sorted(_counters.items())
+    for (page, name), e in spans:
+        labels = f'page="{_label(page)}",span="{_label(name)}"'
+        cumulative = 0
+        for bound, n in zip(BUCKETS, e['buckets']):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'corpus_span_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f'corpus_span_seconds_sum{{{labels}}} {e["sum"]}')
+        lines.append(f'corpus_span_seconds_count{{{labels}}} {e["count"]}')
+    lines += ['# HELP corpus_events_total Instrumented events such as cache hits.',
+              '# TYPE corpus_events_total counter']
+    for (page, name), value in counters:
+        lines.append(f'corpus_events_total{{page="{_label(page)}",name="{_label(name)}"}} {value}')
+    lines += ['# HELP corpus_component_stat Statistics reported by components.', '# TYPE corpus_component_stat gauge']
+    for component, values in snapshot()['stats'].items():
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'corpus_component_stat{{component="{_label(component)}",stat="{_label(key)}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
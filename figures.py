@@ -0,0 +1,106 @@
+"""
+    Chart helpers for large series.
+
+    lttb() downsamples a line to about the number of points a chart column can show, keeping its shape
+    (Largest-Triangle-Three-Buckets: from every bucket it keeps the point that spans the largest triangle
+    with its neighbours). line_trace() uses it and switches to a WebGL trace (Scattergl) when many
+    points are still left, instead of drawing each point as an SVG path.
+
+    FigureCache keeps built figures as JSON, keyed on the inputs of the chart (including the version of
+    the data file), so a rerun with unchanged inputs skips building the figure again. The limit is set
+    in MB with CORPUS_FIGURE_CACHE_MB (default 32).
+"""
+import os
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+import diagnostics
+
+CHART_POINTS = 1000  # about twice the pixel width of one of three chart columns
+WEBGL_POINTS = 500
+
+
+def lttb(x, y, threshold=CHART_POINTS):
+    """
+        :param x: 横坐标（数值，递增）
+        :param y: 纵坐标
+        :param threshold: 保留的点数
+        :return: 保留的点的位置（包括第一个和最后一个点）
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # 除第一个和最后一个点外分成threshold - 2个桶
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i + 2]].mean()
+            next_y = y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def line_trace(x, y, text=None, threshold=CHART_POINTS, **kwargs):
+    """
+        折线：点数多时先降采样，仍然很多时用WebGL绘制
+        :param text: 每个点的说明（显示在hover中）
+        :return: go.Scatter 或 go.Scattergl
+    """
+    keep = lttb(x, y, threshold)
+    x = np.asarray(x)[keep]
+    y = np.asarray(y)[keep]
+    if text is not None:
+        text = np.asarray(text, dtype=object)[keep]
+    trace = go.Scattergl if len(keep) > WEBGL_POINTS else go.Scatter
+    return trace(x=x, y=y, text=text, mode='lines', **kwargs)
+
+
+class FigureCache:
+    def __init__(self, limit_mb=32):
+        self.limit = int(limit_mb * 1024 * 1024)
+        self.size = 0
+        self._entries = OrderedDict()  # key -> JSON
+        self._lock = threading.Lock()
+
+    def get(self, build, **inputs):
+        """
+            :param build: 无参数函数，返回plotly figure（只在缓存中没有时调用）
+            :param inputs: 决定图表内容的所有参数
+            :return: plotly figure
+        """
+        key = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+        with self._lock:
+            figure = self._entries.get(key)
+            if figure is not None:
+                self._entries.move_to_end(key)
+        diagnostics.count('figure_cache.miss' if figure is None else 'figure_cache.hit')
+        if figure is None:
+            with diagnostics.span('figure.build'):
+                figure = build().to_json()
+            with self._lock:
+                if key not in self._entries and len(figure) <= self.limit:
+                    self._entries[key] = figure
+                    self.size += len(figure)
+                    while self.size > self.limit:
+                        _, old = self._entries.popitem(last=False)
+                        self.size -= len(old)
+        return pio.from_json(figure)
+
+
+figure_cache = FigureCache(float(os.environ.get('CORPUS_FIGURE_CACHE_MB', 32)))
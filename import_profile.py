@@ -0,0 +1,37 @@
+"""
+    Import-time report for the pages.
+
+    Heavy libraries are imported inside the page functions that use them. Wrapping those imports in
+    import_timer(page) records, the first time a page loads them, how long it took and which top-level
+    packages were new to the process. Later reruns import nothing new and leave the record unchanged.
+"""
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+_report = {}  # page -> (seconds, [new top-level packages])
+_lock = threading.Lock()
+
+
+@contextmanager
+def import_timer(page):
+    before = set(sys.modules)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        new = sorted({name.split('.')[0] for name in set(sys.modules) - before})
+        if new:
+            with _lock:
+                old_seconds, old_new = _report.get(page, (0.0, []))
+                _report[page] = (old_seconds + seconds, sorted(set(old_new) | set(new)))
+
+
+def import_report():
+    """
+        :return: {page: (seconds, [new top-level packages])}
+    """
+    with _lock:
+        return dict(_report)
@@ -1,24 +1,14 @@
-import nltk
-import streamlit as st
-import pandas as pd
-import os
-import wordcloud
-import re
-import spacy_streamlit
-import plotly.express as px
-import plotly.graph_objects as go
-import plotly.figure_factory as ff
-from transformers import AutoTokenizer, AutoModelWithLMHead
-from annotated_text import annotated_text
-from PIL import Image
-from nltk.tree import Tree
-from stanfordcorenlp import StanfordCoreNLP
-from nltk.util import ngrams
-from collections import Counter
-import sqlite3
-import spacy
-
-connection = sqlite3.connect("corpora_data.db")
+from import_profile import import_timer, import_report
+
+# 只在启动时导入轻量的模块，其他模块在用到它们的页面中导入
+with import_timer("Startup"):
+    import streamlit as st
+    import pandas as pd
+    import os
+    from db_pool import pool
+    from paged_table import PAGE_SIZE, FrameView, page_count, view
+    import json
+    import diagnostics
 
 st.set_page_config(
     page_title="a Python Tool for Visualizing and Analyzing Domain-Specific Corpora",
@@ -27,15 +17,56 @@ st.set_page_config(
 )
 
 
-def get_df_from_db(sql):
-    cursor = connection.cursor()
-    cursor.execute(sql)
-    data = cursor.fetchall()
-    columnDes = cursor.description  # 获取连接对象的描述信息
-    columnNames = [columnDes[i][0] for i in range(len(columnDes))]
-    df = pd.DataFrame([list(i) for i in data], columns=columnNames)
-    # print(df)
-    return df
+def _view(df, column, sort_by, ascending, contains):
+    if callable(df):
+        return df(sort_by, ascending, contains)
+    return FrameView(view(df, sort_by, ascending, contains, column), column)
+
+
+def _jump(key, df, column, page_size):
+    # 在页码输入框创建之前运行（回调），所以可以直接修改它的值
+    state = st.session_state
+    target = state[f'{key}_jump']
+    if not target.strip():
+        return
+    shown = _view(df, column, state.get(f'{key}_sort'), state.get(f'{key}_ascending', True), state.get(f'{key}_filter'))
+    position = shown.locate(target)
+    if position is None:
+        state[f'{key}_message'] = f'"{target}" is not in the table'
+    else:
+        state[f'{key}_page'] = position // page_size + 1
+        state[f'{key}_message'] = f'"{target}" is row {position % page_size + 1} of page {state[f"{key}_page"]}'
+
+
+def paged_dataframe(df, key, column=None, sort_columns=(), page_size=PAGE_SIZE):
+    """
+        分页显示表格：筛选、排序和翻页都在服务器端完成，每次只把一页发送给浏览器
+        :param df: 完整的表格，或函数 (sort_by, ascending, contains) -> 视图（如CorpusStore.word_freq）
+        :param key: 控件key的前缀（同一页面中不能重复）
+        :param column: 用于筛选和按值跳转的列
+        :param sort_columns: 可以排序的列（第一个为默认顺序）
+    """
+    state = st.session_state
+    sort_by = None
+    ascending = True
+    if sort_columns:
+        sort_by = st.selectbox('Sort by', sort_columns, key=f'{key}_sort')
+        ascending = st.checkbox('Ascending', value=True, key=f'{key}_ascending')
+    contains = st.text_input('Filter', key=f'{key}_filter') if column else None
+    shown = _view(df, column, sort_by, ascending, contains)
+
+    pages = page_count(len(shown), page_size)
+    # 页码只通过Session State设置（跳转和翻页范围），控件本身不再给默认值
+    state.setdefault(f'{key}_page', 1)
+    if state[f'{key}_page'] > pages:
+        state[f'{key}_page'] = pages
+    st.text_input('Jump to rank/word' if column else 'Jump to row', key=f'{key}_jump',
+                  on_change=_jump, args=(key, df, column, page_size))
+    if state.get(f'{key}_message'):
+        st.caption(state.pop(f'{key}_message'))
+    page = st.number_input('Page', min_value=1, max_value=pages, step=1, key=f'{key}_page')
+    st.caption(f"{len(shown)} rows, page {page} of {pages}")
+    st.dataframe(shown.page(page - 1, page_size), use_container_width=True)
 
 
 def intro():
@@ -62,22 +93,10 @@ It can be used to compare the linguistic features of different corpora to have a
     )
 
 
-def Traverse_Path(Path):
-    """
-        yzuy
-        遍历路径，获取路径下的文件列表
-        :param Path: 目标路径
-        :return: FileList: 路径下的文件列表
-    """
-    FileList = []
-    for roots, dirs, files in os.walk(Path):
-        for file in files:
-            FilePath = os.path.join(roots, file)
-            FileList.append(FilePath)
-    return FileList
-
-
 def overview():
+    with import_timer("Overview"):
+        import queries
+
     st.title("Overview")
 
     fields = (
@@ -109,18 +128,6 @@ def overview():
         "General": "BNC_Baby"
     }
 
-    books = dict({})  # 所有书名的字典
-
-    OriginPath = '.\\book'  # 待测文本存储位置
-    FileList = Traverse_Path(OriginPath)
-    for field in fields:
-        for file in FileList:
-            if field in file:
-                if field not in books:
-                    books[field] = []
-                else:
-                    books[field].append(file)
-
     option1 = st.multiselect(
         'Please select fields',
         fields)
@@ -130,7 +137,7 @@ def overview():
         Features
     )
 
-    df = get_df_from_db(f"select * from {Features_meaning[option2]}")
+    df = queries.feature_table(Features_meaning[option2])
     df.set_index('field1', inplace=True)
     df = df.T
     index_name = df.index.values
@@ -151,6 +158,20 @@ def overview():
 
 
 def word():
+    with import_timer("Word-level Analysis"):
+        import plotly.express as px
+        import plotly.graph_objects as go
+        from PIL import Image
+        from figures import figure_cache, line_trace
+        from columnar import load_table, table_file
+        from data_cache import cache, cached_table, cached_summary, prefetch, ranked_table
+        from columnar import ALL_POS, FIELDS
+        import queries
+        from subcorpus import COUNTS_META, load_matrix
+        from keyness import CRITICAL_VALUES, MEASURES, cached_compare, keywords
+        from corpus_store import field_store
+        from wordcloud_render import cache as wordcloud_cache, cloud_key, read_stopwords, top_freqs
+
     st.title("Word-level Analysis")
 
     options = st.multiselect('Select 2~3 fields that you would like to compare',
@@ -160,11 +181,19 @@ def word():
                              ['General', 'Business', 'History'],
                              max_selections=3)
 
+    # 在后台同时读取所选领域的数据（包括其他标签页要用的），下面按列显示时直接从缓存中取；
+    # 有共享的corpus store时词表直接从内存映射的文件中读取，不再载入每个进程
+    prefetch([call for field in options for call in (((ranked_table, 'word_freq', field),
+                                                       (cached_table, 'word_attribute', field),
+                                                       (cached_table, 'cumulative_word_frequency', field))
+                                                      if field_store(field) is None else ())
+              + ((cached_summary, field),)])
+
     # 1.Basic Information
     st.subheader("Basic Information")
 
     # 可视化basic information：type，token，TTR
-    basic_info = pd.read_excel(rf".\word_attribute\basic_information.xlsx", index_col=0)
+    basic_info = load_table('basic_information')
     df_basic_info = pd.DataFrame(basic_info)  # basic information全部数据转化成dataframe格式
     # 选择需要显示的数据
     df = df_basic_info.loc[options]
@@ -230,15 +259,9 @@ def word():
         st.plotly_chart(fig, theme=None, use_container_width=True)
 
     # 2.Information about the Search Word
+    # fields为None时查询所有领域
     def search_word_freq_and_pos(search_word, fields):
-        df = pd.DataFrame()
-        for field in fields:
-            word = pd.read_excel(rf".\word_attribute_pos_count\{field}_word_attribute.xlsx")
-            word_df = pd.DataFrame(word)
-            new_df = word_df.query("word == @search_word")
-            if (len(new_df) != 0):
-                new_df.loc[:, 'field'] = field
-                df = pd.concat([df, new_df])
+        df = queries.word(search_word, fields)
         if len(df) != 0:
             data_load_state = st.info('Loading ...', icon="🤔")
             fig = px.bar(df,
@@ -261,8 +284,12 @@ def word():
 
     st.subheader("Information about the Search Word")
     search_word = st.text_input('Search a word', 'trapped')
+    all_fields = st.checkbox('Search in all fields')
 
-    if len(options) == 0:
+    if all_fields:
+        if search_word:
+            search_word_freq_and_pos(search_word, None)
+    elif len(options) == 0:
         st.warning('Please select at least one field!', icon="⚠️")
     else:
         if search_word:
@@ -273,36 +300,47 @@ def word():
 
     # 用于显示word frequency水平条形统计图
     def word_freq_chart(field, number):
-        word_freq = pd.read_excel(rf".\word_freq\{field}_word_frequencies.xlsx")
-        word_freq_df = pd.DataFrame(word_freq)
-        word_freq_showed = word_freq_df.sort_values(by="freq", ascending=False).head(int(number))
-        # print(word_freq_showed)
-        word_freq_showed = word_freq_showed.sort_values(by='freq', ascending=True)
-        fig = px.bar(word_freq_showed,
-                     x="freq",
-                     y="word",
-                     color_discrete_sequence=px.colors.sequential.Cividis,
-                     title=rf"The First {number} Words of {field} Corpus",
-                     text_auto=True,
-                     orientation='h',
-                     height=600)
-        fig.update_xaxes(title_text='Number')
-        fig.update_yaxes(title_text='Word')
-        fig.update_traces(hovertemplate='Word : %{y:,.}<br>Number : %{x}')
+        def build():
+            store = field_store(field)
+            if store is not None:
+                word_freq_showed = store.word_freq(field).page(0, int(number))[['word', 'freq']]
+            else:
+                word_freq_showed = ranked_table('word_freq', field)[['word', 'freq']].head(int(number))
+            word_freq_showed = word_freq_showed.sort_values(by='freq', ascending=True)
+            fig = px.bar(word_freq_showed,
+                         x="freq",
+                         y="word",
+                         color_discrete_sequence=px.colors.sequential.Cividis,
+                         title=rf"The First {number} Words of {field} Corpus",
+                         text_auto=True,
+                         orientation='h',
+                         height=600)
+            fig.update_xaxes(title_text='Number')
+            fig.update_yaxes(title_text='Word')
+            fig.update_traces(hovertemplate='Word : %{y:,.}<br>Number : %{x}')
+            return fig
+
+        fig = figure_cache.get(build, chart='word_freq', field=field, number=number,
+                               version=os.path.getmtime(table_file('word_freq', field)))
         st.plotly_chart(fig, theme=None, use_container_width=True)
 
     # 读取word frequency数据
     def read_word_freq(field):
-        word_freq = pd.read_excel(rf".\word_freq\{field}_word_frequencies.xlsx")
-        word_freq_df = pd.DataFrame(word_freq)
-        df = word_freq_df.sort_values(by="freq", ascending=False).reset_index(drop=True)
-        df.index = df.index + 1
-        st.dataframe(df, use_container_width=True)
+        store = field_store(field)
+        source = ranked_table('word_freq', field) if store is None else \
+            lambda sort_by, ascending, contains: store.word_freq(field, sort_by, ascending, contains)
+        paged_dataframe(source, f'word_freq_{field}', column='word', sort_columns=['rank', 'word', 'word_lengths'])
 
     # 生成pos proportion pie chart
+    # 由汇总数据计算词性比例
+    def pos_proportion(field):
+        summary = cached_summary(field)
+        df = summary[summary.pos_tag != ALL_POS].groupby('pos_tag', as_index=False)['tokens'].sum()
+        df['percentage(%)'] = df['tokens'] / df['tokens'].sum() * 100
+        return df.sort_values('tokens', ascending=False)
+
     def pos_proportion_pie_chart(field):
-        pos_proportion = pd.read_excel(rf".\pos_proportion\{field}_pos_proportion.xlsx")
-        pos_proportion_df = pd.DataFrame(pos_proportion)
+        pos_proportion_df = pos_proportion(field)
         fig = px.pie(pos_proportion_df,
                      values='percentage(%)',
                      names='pos_tag',
@@ -312,8 +350,7 @@ def word():
         st.plotly_chart(fig, theme=None, use_container_width=True)
 
     def pos_proportion_bar_chart(field):
-        pos_proportion = pd.read_excel(rf".\pos_proportion\{field}_pos_proportion.xlsx")
-        pos_proportion_df = pd.DataFrame(pos_proportion)
+        pos_proportion_df = pos_proportion(field)
         fig = px.bar(pos_proportion_df,
                      x="pos_tag",
                      y="percentage(%)",
@@ -327,9 +364,12 @@ def word():
         st.plotly_chart(fig, theme=None, use_container_width=True)
 
     def show_first_few_word_by_pos(field, pos, count):
-        word_pos = pd.read_excel(rf".\word_attribute_pos_count\{field}_word_attribute.xlsx")
-        word_pos_df = pd.DataFrame(word_pos)
-        word_pos_df = word_pos_df.query('pos_tag==@pos').head(int(count))
+        store = field_store(field)
+        if store is not None:
+            word_pos_df = store.word_attribute(field, pos, int(count))
+        else:
+            word_pos = cached_table('word_attribute', field)
+            word_pos_df = word_pos[word_pos.pos_tag == pos].head(int(count))
         word_pos_df = word_pos_df.sort_values(by='count', ascending=True)
 
         fig = px.bar(word_pos_df,
@@ -347,39 +387,49 @@ def word():
 
     # 累积频率图
     def cumulative_frequency_graph(field, number):
-        cumul_freq = pd.read_excel(rf".\cumulative_word_frequency\{field}_cumulative_word_frequency.xlsx")
-        cumul_freq_df = pd.DataFrame(cumul_freq).head(int(number))
-
-        if number <= 50:
-            fig = px.line(cumul_freq_df,
-                          x='word',
-                          y='cumulative_freq',
-                          title=f'Cumulative Word Frequency of the First {number} Common Words',
-                          color_discrete_sequence=px.colors.sequential.haline,
-                          height=500)
-
-            fig.update_xaxes(title_text='Common Words')
-            fig.update_yaxes(title_text='Cumulative Counts')
-            fig.update_traces(hovertemplate='Common Word : %{x}<br>Cumulative Counts : %{y:,.}')
-            st.plotly_chart(fig, theme=None, use_container_width=True)
-        else:
-            arr = [x for x in range(1, int(number) + 1)]
-            fig = px.line(cumul_freq_df,
-                          x=arr,
-                          y='cumulative_freq',
-                          title=f'Cumulative Word Frequency of the First {number} Common Words',
-                          color_discrete_sequence=px.colors.sequential.haline,
-                          height=500)
-            if number <= 100:
-                tick = 10
-            elif 100 < number < 500:
-                tick = 50
+        def build():
+            store = field_store(field)
+            if store is not None:
+                cumul_freq_df = store.cumulative_word_frequency(field, int(number))
             else:
-                tick = 100
-            fig.update_xaxes(title_text='Common Words', dtick=tick)
+                cumul_freq_df = cached_table('cumulative_word_frequency', field).head(int(number))
+
+            if number <= 50:
+                fig = px.line(cumul_freq_df,
+                              x='word',
+                              y='cumulative_freq',
+                              title=f'Cumulative Word Frequency of the First {number} Common Words',
+                              color_discrete_sequence=px.colors.sequential.haline,
+                              height=500)
+                fig.update_xaxes(title_text='Common Words')
+                fig.update_traces(hovertemplate='Common Word : %{x}<br>Cumulative Counts : %{y:,.}')
+            else:
+                # 点多时按图宽降采样，仍然较多时用WebGL绘制
+                fig = go.Figure(line_trace(range(1, len(cumul_freq_df) + 1),
+                                           cumul_freq_df['cumulative_freq'],
+                                           text=cumul_freq_df['word'],
+                                           line_color=px.colors.sequential.haline[0],
+                                           hovertemplate='Common Word : %{x} (%{text})'
+                                                         '<br>Cumulative Counts : %{y:,.}<extra></extra>'))
+                fig.update_layout(title=f'Cumulative Word Frequency of the First {number} Common Words',
+                                  height=500)
+                if number <= 100:
+                    tick = 10
+                elif 100 < number < 500:
+                    tick = 50
+                else:
+                    tick = 100
+                fig.update_xaxes(title_text='Common Words', dtick=tick)
             fig.update_yaxes(title_text='Cumulative Counts')
-            fig.update_traces(hovertemplate='Common Word : %{x}<br>Cumulative Counts : %{y:,.}')
-            st.plotly_chart(fig, theme=None, use_container_width=True)
+            return fig
+
+        fig = figure_cache.get(build, chart='cumulative_frequency', field=field, number=number,
+                               version=os.path.getmtime(table_file('cumulative_word_frequency', field)))
+        st.plotly_chart(fig, theme=None, use_container_width=True)
+
+    pos_tags = ['NN', 'FW', 'CD', 'NNPS', 'LS', 'NNP', 'JJ', 'JJS', 'VBZ', 'RB', 'VBD', 'MD', 'IN', 'PRP$', 'JJR',
+                'UH', 'PDT', 'WP$', 'WRB', 'RBR', 'DT', 'POS', 'RP', 'EX', 'NNS', 'VBG', 'WP', 'TO', 'VB', 'RBS',
+                'PRP', 'WDT', 'CC', 'VBN', 'VBP', 'SYM']
 
     tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["Word Frequency Graphs",
                                                   "Word Frequency Lists",
@@ -488,9 +538,7 @@ def word():
         else:
             option = st.selectbox(
                 'Select a  part of speech',
-                ['NN', 'FW', 'CD', 'NNPS', 'LS', 'NNP', 'JJ', 'JJS', 'VBZ', 'RB', 'VBD', 'MD', 'IN', 'PRP$', 'JJR',
-                 'UH', 'PDT', 'WP$', 'WRB', 'RBR', 'DT', 'POS', 'RP', 'EX', 'NNS', 'VBG', 'WP', 'TO', 'VB', 'RBS',
-                 'PRP', 'WDT', 'CC', 'VBN', 'VBP', 'SYM'])
+                pos_tags)
 
             number = st.slider(
                 'Select the number of the first few words displayed',
@@ -512,9 +560,47 @@ def word():
     # 4.Wordcloud
     st.subheader("Word Cloud")
 
+    with st.expander("Customize word clouds"):
+        cloud_pos = st.multiselect('Only words in these parts of speech', pos_tags)
+        cloud_stopwords = st.checkbox('Leave out the words in stopwords.txt', True)
+        cloud_extra = st.text_input('Other words to leave out (separated by spaces)')
+    stopwords = set(read_stopwords()) if cloud_stopwords else set()
+    stopwords |= {w.lower() for w in cloud_extra.split()}
+    customized = bool(cloud_pos or cloud_extra or not cloud_stopwords)
+
+    # 生成词云用的词频
+    def field_cloud_freqs(field):
+        if cloud_pos:
+            word_pos = cached_table('word_attribute', field)
+            counts = word_pos[word_pos.pos_tag.isin(cloud_pos)].groupby('word')['count'].sum()
+            return top_freqs(counts.index, counts.values, stopwords)
+        word_freq = cached_table('word_freq', field)
+        return top_freqs(word_freq['word'], word_freq['freq'], stopwords)
+
+    # 显示词云：没有自定义时使用预先生成的图片，否则在后台生成
+    def show_cloud(key, freqs_factory, caption):
+        png = wordcloud_cache.request(key, freqs_factory)
+        error = wordcloud_cache.failure(key)
+        if png is not None:
+            st.image(png, caption=caption)
+        elif wordcloud_cache.pending(key):
+            st.info(f'Rendering the word cloud of {caption}...', icon="🤔")
+            st.button('Refresh', key=f'refresh_{key}')
+        elif error is not None:
+            st.error(f'Could not render the word cloud of {caption}: {error}', icon="🚨")
+            st.button('Retry', key=f'retry_{key}', on_click=wordcloud_cache.retry, args=(key,))
+        else:
+            st.warning(f'No words left for the word cloud of {caption}', icon="⚠️")
+
     def wordcloud_show(field):
-        image = Image.open(fr'.\wordcloud\{field}.png')
-        st.image(image, caption=f'{field}')
+        path = fr'.\wordcloud\{field}.png'
+        if not customized and os.path.exists(path):
+            image = Image.open(path)
+            st.image(image, caption=f'{field}')
+            return
+        key = cloud_key(fields=[field], pos=sorted(cloud_pos), stopwords=sorted(stopwords),
+                        version=os.path.getmtime(table_file('word_freq', field)))
+        show_cloud(key, lambda: field_cloud_freqs(field), field)
 
     if len(options) == 0:
         st.warning('Please select at least one field!', icon="⚠️")
@@ -537,15 +623,11 @@ def word():
         fig = go.Figure()
         colors = ['#A56CC1', '#A6ACEC', '#63F5EF']
         for field in fields:
-            word_length = pd.read_excel(rf".\word_freq\{field}_word_frequencies.xlsx")
-            word_length_df = pd.DataFrame(word_length)
-            word_length_df.groupby(['word_lengths']).size()
-            df = pd.DataFrame(word_length_df.groupby(['word_lengths']).size()).reset_index()
-            df.columns = ["word_lengths", "count"]
-            df.loc[:, "field"] = field
+            summary = cached_summary(field)
+            df = summary[summary.pos_tag == ALL_POS].sort_values('word_lengths')
 
             fig.add_trace(go.Bar(x=df["word_lengths"],
-                                 y=df["count"],
+                                 y=df["types"],
                                  name=f'{field}'
                                  ))
 
@@ -565,11 +647,12 @@ def word():
     def word_lengths_histograms(fields):
         fig = go.Figure()
         for field in fields:
-            word_length = pd.read_excel(rf".\word_freq\{field}_word_frequencies.xlsx")
-            word_length_df = pd.DataFrame(word_length)
-            hist = go.Histogram(x=word_length_df["word_lengths"],
-                                name=f'{field}',
-                                histnorm='percent')
+            summary = cached_summary(field)
+            df = summary[summary.pos_tag == ALL_POS].sort_values('word_lengths')
+            # 各词长的类符数占比（与histnorm='percent'的直方图相同）
+            hist = go.Bar(x=df["word_lengths"],
+                          y=df["types"] / df["types"].sum() * 100,
+                          name=f'{field}')
             fig.add_trace(hist)
         fig.update_layout(barmode='relative',
                           bargap=0.05,
@@ -601,45 +684,128 @@ def word():
             word_lengths_histograms(options)
             data_load_state.success('Loading graphs...done!', icon="😊")
 
-    # 7."The Full Name of Part of Speech"
+    # 6.Custom Subcorpus
+    st.subheader("Custom Subcorpus")
+    matrix = load_matrix()
+    if matrix is None:
+        st.info('Run python preprocess.py to enable comparisons of custom combinations of books.', icon="ℹ️")
+    else:
+        book_labels = {f'{field} / {title}': (field, title) for field, title in matrix.books}
+        matrix_version = os.path.getmtime(COUNTS_META)
+        number = st.slider('Select the number of the first few words displayed', 5, 100, 10, key='subcorpus_number')
+        col1, col2 = st.columns(2)
+        for col, name in ((col1, 'Subcorpus A'), (col2, 'Subcorpus B')):
+            with col:
+                selected = st.multiselect(f'Books in {name}', list(book_labels), key=name)
+                if not selected:
+                    st.warning('Please select at least one book!', icon="⚠️")
+                    continue
+                chosen = [book_labels[label] for label in selected]
+                st.dataframe(pd.DataFrame(matrix.basic_information(chosen), index=[name]), use_container_width=True)
+
+                word_freq_showed = matrix.word_freq(chosen).head(int(number)).sort_values(by='freq', ascending=True)
+                fig = px.bar(word_freq_showed,
+                             x="freq",
+                             y="word",
+                             color_discrete_sequence=px.colors.sequential.Cividis,
+                             title=rf"The First {number} Words of {name}",
+                             text_auto=True,
+                             orientation='h',
+                             height=600)
+                fig.update_xaxes(title_text='Number')
+                fig.update_yaxes(title_text='Word')
+                fig.update_traces(hovertemplate='Word : %{y:,.}<br>Number : %{x}')
+                st.plotly_chart(fig, theme=None, use_container_width=True)
+
+                fig = px.bar(matrix.pos_proportion(chosen),
+                             x="pos_tag",
+                             y="percentage(%)",
+                             color_discrete_sequence=px.colors.sequential.Agsunset,
+                             title=f"Part of Speech Proportion of {name}",
+                             height=500)
+                fig.update_xaxes(title_text='Part of Speech')
+                fig.update_yaxes(title_text='Percentage', ticksuffix="%")
+                fig.update_traces(hovertemplate='%{x}<br>Percentage : %{y:,.4f}%')
+                st.plotly_chart(fig, theme=None, use_container_width=True)
+
+                key = cloud_key(books=sorted(chosen), stopwords=sorted(stopwords), version=matrix_version)
+                show_cloud(key, lambda: top_freqs(matrix.vocab, matrix.word_counts(chosen), stopwords), name)
+
+    # 7.Keyness
+    st.subheader("Keyness")
+    compare_with = st.radio('Compare', ['Two fields', 'Subcorpus A with Subcorpus B'], horizontal=True,
+                            key='keyness_compare')
+    if compare_with == 'Two fields':
+        col1, col2 = st.columns(2)
+        target = col1.selectbox('Target', FIELDS, key='keyness_target')
+        reference = col2.selectbox('Reference', ['Rest of the corpus'] + [f for f in FIELDS if f != target],
+                                   key='keyness_reference')
+        reference = None if reference == 'Rest of the corpus' else reference
+    elif matrix is None:
+        target = reference = None
+    else:
+        target = [book_labels[label] for label in st.session_state.get('Subcorpus A', [])]
+        reference = [book_labels[label] for label in st.session_state.get('Subcorpus B', [])]
+    col1, col2, col3, col4 = st.columns(4)
+    direction = col1.radio('Keywords', ['positive', 'negative'], key='keyness_direction',
+                           help='Positive: more frequent in the target. Negative: more frequent in the reference.')
+    measure = col2.selectbox('Rank by', MEASURES, key='keyness_measure')
+    significance = col3.selectbox('Significance', list(CRITICAL_VALUES), key='keyness_significance')
+    min_frequency = col4.number_input('Minimum frequency', min_value=1, value=5, key='keyness_min_frequency')
+
+    if not target or (compare_with != 'Two fields' and not reference):
+        st.warning('Please select the books of both subcorpora above!', icon="⚠️")
+    elif compare_with == 'Two fields' and matrix is None and reference is None:
+        st.info('Run python preprocess.py to compare a field with the rest of the corpus.', icon="ℹ️")
+    else:
+        table = keywords(cached_compare(target, reference), direction, measure, min_frequency,
+                         CRITICAL_VALUES[significance])
+        paged_dataframe(table, 'keyness', 'word')
+
+    # 8."The Full Name of Part of Speech"
     st.subheader("The Full Name of Part of Speech")
-    full_name = pd.read_excel(r".\word_attribute_pos_count\pos_full_name.xlsx")
+    full_name = load_table('pos_full_name')
     full_name_df = pd.DataFrame(full_name)
     full_name_df.columns = ["abbreviation", "full_name"]
     full_name_df.index = full_name_df.index + 1
     st.dataframe(full_name_df, use_container_width=True)
 
+    with st.sidebar.expander("Data cache"):
+        stats = cache.stats()
+        st.caption(f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions")
+        st.caption(f"{stats['entries']} tables, {stats['size_mb']} / {stats['limit_mb']} MB")
+
 
 def sentence():
+    with import_timer("Sentence-level Analysis"):
+        import spacy_streamlit
+        from columnar import load_table
+        from search_index import has_table
+        import queries
+        from sentence_store import book_sheets
+        from nlp_service import get_service
+        from catalog import get_catalog
+        from sentence_features import job_status, start_job
+
     st.title("Sentence-level Analysis")
 
     fields = (
         'Business', 'Economics', 'History', 'Linguistics', 'Management', 'Media_communication', 'Philosophy',
         'Psychology')
 
-    books = dict({})  # 所有书名的字典
-
-    OriginPath = '.\\book'  # 待测文本存储位置
-    FileList = Traverse_Path(OriginPath)
-    for field in fields:
-        for file in FileList:
-            if field in file:
-                if field not in books:
-                    books[field] = []
-                else:
-                    filename = file.split('\\')[-1]
-                    books[field].append(filename[:-4])
-
     option1 = st.selectbox(
         'Please select a field',
         fields)
 
+    # 书名来自内存中的书目（catalog.py），不再每次遍历book文件夹
+    titles = get_catalog().titles(option1)
     options = st.multiselect(
         'Please select a book',
-        books[f'{option1}'],
-        [books[f'{option1}'][1]])
+        titles,
+        titles[:1])
 
-    excel_total = pd.ExcelFile(rf".\sentences_attribute\{option1}_sentences_attribute.xlsx")
+    # 书名 -> 工作表名
+    sheets = book_sheets(option1, options)
 
     if not options:
         st.write("Please select a book!")
@@ -647,54 +813,100 @@ def sentence():
         data_load_state = st.info('Loading data...', icon="🤔")
         st.subheader(f"Basic Information of {option1}")
 
-        basicinfo = pd.read_excel(rf".\sentences_attribute\sentences_total_attribute.xlsx")
+        basicinfo = load_table('sentences_total_attribute')
         st.dataframe(basicinfo.query('field == @option1'))
 
-        df_all_sen = pd.DataFrame()
-        for option in options:
-            cut = option[:20]
-            for sheet_name in excel_total.sheet_names:
-                if cut in sheet_name:
-                    df_sen = pd.read_excel(rf'.\sentences_attribute\{option1}_sentences_attribute.xlsx',
-                                           sheet_name=sheet_name)
-                    df_all_sen = pd.concat([df_all_sen, df_sen])
+        selected_sheets = [sheets[option] for option in options if option in sheets]
 
         sen = st.text_input('Search', 'word')
+        # 建立了全文索引（python search_index.py）时可以按词、词组或前缀查询
+        mode = 'Substring'
+        if pool.run(has_table, 'sentences_fts'):
+            mode = st.radio('Search mode', ['Substring', 'Token', 'Phrase', 'Prefix'], horizontal=True)
         st.warning('Double click to see the whole sentence', icon="⚠️")
-        df_after = df_all_sen[df_all_sen.sentences.str.contains(f"{sen}")].reset_index().drop('index', axis=1)
+
+        # 子串查询（按字面匹配）在corpus store中进行，只解码这一页的句子；没有store时读所选的书
+        whole_corpus = mode != 'Substring' and st.checkbox('Search all books of all fields')
+        page_size = 50
+        state = st.session_state
+        search = (sen, mode, whole_corpus, option1, tuple(selected_sheets))
+        # 换了查询就回到第一页
+        if state.get('sentence_search') != search:
+            state['sentence_search'] = search
+            state['sentence_page'] = 1
+        page = st.number_input('Page', min_value=1, step=1, key='sentence_page')
+        df_after, total = queries.sentences(sen, mode.lower(),
+                                            field=None if whole_corpus else option1,
+                                            books=None if whole_corpus else selected_sheets,
+                                            page=page - 1, page_size=page_size)
+        # 编号从这一页的第一句开始，与下面的句子编号一致
+        df_after = df_after.reset_index(drop=True)
+        st.caption(f"{total} sentences found, page {page} of {page_count(total, page_size)}")
         st.dataframe(df_after)
 
         data_load_state.success('Loading data...done!', icon="😊")
 
-        number = st.number_input('Please type in the index of a sentence for more information', step=1, value=-1)
-
-        nlp = StanfordCoreNLP(r'.\stanfordnlp', lang='en')
+        number = st.number_input('Please type in the index of a sentence on this page for more information',
+                                 min_value=-1, max_value=len(df_after) - 1, step=1, value=-1)
 
         if number >= 0:
             data_load_state = st.info('Loading data...', icon="🤔")
             sentence_tree = df_after.iloc[number].at['sentences']
             data_load_state.success('Loading... done!', icon="😊")
 
-            sen_pos = df_after.iloc[number].at['tagged']
-            reg = re.findall(r"\(.+?\)", sen_pos)
-
-            print(reg)
             # 选中句子的信息的分析
-            nlp = spacy.load("en_core_web_sm")
-            doc = nlp(sentence_tree)
+            nlp = get_service('spacy')
+            doc = nlp.parse(sentence_tree)
             spacy_streamlit.visualize_parser(doc)
-            spacy_streamlit.visualize_ner(doc, labels=nlp.get_pipe("ner").labels)
+            spacy_streamlit.visualize_ner(doc, labels=nlp.model.get_pipe("ner").labels)
             spacy_streamlit.visualize_tokens(doc)
 
+        # 整本书的句法和命名实体统计（python sentence_features.py 或下面的按钮生成）
+        st.subheader("Dependency and Entity Statistics")
+        # 在单独的进程中分析，页面不用等待
+        if st.button('Analyse all sentences of the selected books'):
+            processes = os.environ.get('CORPUS_SPACY_PROCESSES')
+            if not selected_sheets:
+                st.warning('The selected books have no sentences to analyse.', icon="⚠️")
+            elif not start_job(option1, selected_sheets, int(processes) if processes else None):
+                st.warning(f'The sentences of {option1} are already being analysed.', icon="⚠️")
+        status, last_line = job_status(option1)
+        if status == 'running':
+            st.info(f'Analysing sentences in the background... {last_line}', icon="🤔")
+            st.button('Refresh', key='refresh_sentence_features')
+        elif status == 'done':
+            st.success(f'Analysing sentences...done! {last_line}', icon="😊")
+        elif status == 'failed':
+            st.error(f'Analysing sentences failed: {last_line}', icon="🚨")
+        if pool.run(has_table, 'book_sentence_features'):
+            book_stats = pool.read_sql("select * from book_sentence_features where field = ?", (option1,))
+            st.caption(f"Books of {option1}")
+            st.dataframe(book_stats, use_container_width=True)
+            st.caption("Fields")
+            st.dataframe(pool.read_table('field_sentence_features'), use_container_width=True)
+        else:
+            st.write("No sentences have been analysed yet.")
+
         st.balloons()
 
 
 def Collocation():
+    with import_timer("Collocation"):
+        import plotly.express as px
+        import queries
+
     st.header("Collocation")
 
     word = st.text_input('Search', '', placeholder="Enter a word to see the collocations")
     phrase_length = st.number_input('Phrase Length', min_value=2, max_value=10)
     top = st.number_input('Show Top', min_value=1, value=20)
+    measures = {'Frequency': 'frequency', 'PMI': 'pmi', 'Log-likelihood': 'log_likelihood',
+                'T-score': 't_score', 'Dice': 'dice'}
+    rank_by = st.selectbox('Rank By', list(measures))
+    measure = measures[rank_by]
+    # PMI等关联度偏向只出现一两次的罕见组合
+    min_frequency = st.number_input('Minimum Frequency', min_value=1, value=1 if measure == 'frequency' else 3,
+                                    disabled=measure == 'frequency')
 
     col1, col2 = st.columns(2)
 
@@ -708,37 +920,29 @@ def Collocation():
             'Field A',
             fields)
 
-        n_grams = 'n_grams_' + option1
-
         if word:
             if word.isalpha():
                 data_load_state = st.info('Loading data...', icon="🤔")
-                df = get_df_from_db(f"select * from {n_grams} WHERE field3={phrase_length}")
-                del df['field3']
-
-                # 删除首行，首行为text
-                df = df.iloc[1:, :]
-                df.columns = ['Collocations', 'Frequency']
-                df = df[df.Collocations.str.lower().str.contains(word.lower(), na=False)].iloc[:top]
-
-                # 将Frequency转化为int
-                convert_dict = {'Frequency': int}
-                df = df.astype(convert_dict)
-                df = df.sort_values('Frequency', ascending=True)
+                # 在数据库中完成匹配、排序和取前top个
+                df = queries.collocations(option1, word, phrase_length, top, measure, min_frequency)
+                # 还没有计算关联度时按频率排序
+                value = 'Score' if 'Score' in df.columns else 'Frequency'
+                df = df.sort_values(value, ascending=True)
 
                 if len(df) > 0:
 
                     fig = px.bar(df,
-                                 x="Frequency",
+                                 x=value,
                                  y="Collocations",
                                  title="Chart of Field A",
-                                 text_auto=True,
+                                 text_auto=True if value == 'Frequency' else '.3g',
                                  orientation='h',
                                  height=600,
                                  )
-                    fig.update_xaxes(title_text='Number')
+                    label = 'Number' if value == 'Frequency' else rank_by
+                    fig.update_xaxes(title_text=label)
                     fig.update_yaxes(title_text='Word')
-                    fig.update_traces(hovertemplate='Word : %{y:,.}<br>Number : %{x}')
+                    fig.update_traces(hovertemplate='Word : %{y:,.}<br>' + label + ' : %{x}')
                     fig.update_layout(barmode='stack', xaxis={'categoryorder': 'total descending'})
                     st.plotly_chart(fig, theme=None, use_container_width=True)
 
@@ -759,36 +963,28 @@ def Collocation():
             'Field B',
             fields)
 
-        n_grams = 'n_grams_' + option2
-
         if word:
             if word.isalpha():
                 data_load_state = st.info('Loading data...', icon="🤔")
-                df = get_df_from_db(f"select * from {n_grams} WHERE field3={phrase_length}")
-                del df['field3']
-
-                # 删除首行，首行为text
-                df = df.iloc[1:, :]
-                df.columns = ['Collocations', 'Frequency']
-                df = df[df.Collocations.str.lower().str.contains(word.lower(), na=False)].iloc[:top]
-
-                # 将Frequency转化为int
-                convert_dict = {'Frequency': int}
-                df = df.astype(convert_dict)
-                df = df.sort_values('Frequency', ascending=True)
+                # 在数据库中完成匹配、排序和取前top个
+                df = queries.collocations(option2, word, phrase_length, top, measure, min_frequency)
+                # 还没有计算关联度时按频率排序
+                value = 'Score' if 'Score' in df.columns else 'Frequency'
+                df = df.sort_values(value, ascending=True)
 
                 if len(df) > 0:
 
                     fig = px.bar(df,
-                                 x="Frequency",
+                                 x=value,
                                  y="Collocations",
                                  title="Chart of Field B",
-                                 text_auto=True,
+                                 text_auto=True if value == 'Frequency' else '.3g',
                                  # orientation='h',
                                  height=600)
-                    fig.update_xaxes(title_text='Number')
+                    label = 'Number' if value == 'Frequency' else rank_by
+                    fig.update_xaxes(title_text=label)
                     fig.update_yaxes(title_text='Word')
-                    fig.update_traces(hovertemplate='Word : %{y:,.}<br>Number : %{x}')
+                    fig.update_traces(hovertemplate='Word : %{y:,.}<br>' + label + ' : %{x}')
                     st.plotly_chart(fig, theme=None, use_container_width=True)
 
                     # st.dataframe(df, width=1000)
@@ -811,4 +1007,21 @@ page_names_to_funcs = {
 }
 
 demo_name = st.sidebar.selectbox("Choose a demo", page_names_to_funcs.keys())
-page_names_to_funcs[demo_name]()
+with diagnostics.page_context(demo_name), diagnostics.span('page.run'):
+    page_names_to_funcs[demo_name]()
+
+# 各页面读取数据、查询数据库、调用模型和生成图表的耗时
+if st.sidebar.checkbox('Show diagnostics'):
+    with st.sidebar.expander("Diagnostics", expanded=True):
+        report = diagnostics.snapshot()
+        if report['spans']:
+            st.dataframe(pd.DataFrame(report['spans']).drop(columns='buckets'), use_container_width=True)
+        if report['counters']:
+            st.dataframe(pd.DataFrame(report['counters']), use_container_width=True)
+        st.download_button('Download JSON', json.dumps(report, indent=2), 'diagnostics.json', 'application/json')
+        st.download_button('Download Prometheus metrics', diagnostics.prometheus(), 'metrics.txt', 'text/plain')
+
+with st.sidebar.expander("Import times"):
+    for page, (seconds, packages) in import_report().items():
+        st.caption(f"{page}: {seconds:.2f}s")
+        st.caption(", ".join(packages))
@@ -0,0 +1,154 @@
+"""
+    Keyness: the words that are characteristic of one part of the corpus compared with another.
+
+    The word counts of the target and the reference (two fields, a field and the rest of the corpus,
+    or two sets of books) are summed from the rows of the per-book count matrix (subcorpus.py), so
+    both are vectors over the same integer vocabulary and every measure is one numpy expression over
+    the whole vocabulary. With a and b the frequencies of a word and c and d the sizes of the target
+    and the reference:
+
+        log_likelihood  2 * (a * ln(a / E1) + b * ln(b / E2)), E1 = c * (a + b) / (c + d),
+                        E2 = d * (a + b) / (c + d); negative when the word is relatively more frequent
+                        in the reference (Rayson & Garside 2000)
+        percent_diff    (a / c - b / d) / (b / d) * 100 on frequencies per million, with 1e-20 per
+                        million for words missing from the reference, so these stay finite and rank
+                        by their frequency in the target (Gabrielatos & Marchi 2012)
+        log_ratio       log2((a / c) / (b / d)), with 0.5 added to zero frequencies (Hardie 2014)
+
+    keywords() keeps the positive (overused in the target) or negative keywords above a significance
+    threshold and ranks them; queries.keywords() returns one page of them.
+
+    Usage:
+        from keyness import compare, keywords
+        table = compare('History', 'Philosophy')  # or compare([('History', title), ...], None)
+        keywords(table, 'positive', 'log_ratio', min_frequency=5)
+"""
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+from columnar import FIELDS
+from data_cache import cache, cached_table
+from paged_table import rank_ordered
+from subcorpus import COUNTS_META, load_matrix
+
+MEASURES = ('log_likelihood', 'percent_diff', 'log_ratio')
+# 参照语料中没有出现的词在%DIFF中使用的标准化频率（每百万词）
+ZERO_PER_MILLION = 1e-20
+# 自由度为1的卡方分布的临界值
+CRITICAL_VALUES = {'p < 0.05': 3.84, 'p < 0.01': 6.63, 'p < 0.001': 10.83, 'p < 0.0001': 15.13, 'All': 0.0}
+
+
+def scores(target, reference):
+    """
+        :param target: 目标语料中每个词的频数（按词编号）
+        :param reference: 参照语料中每个词的频数（词编号与target相同）
+        :return: dict，measure -> ndarray
+    """
+    a = np.asarray(target, dtype=np.float64)
+    b = np.asarray(reference, dtype=np.float64)
+    c = a.sum() or 1.0
+    d = b.sum() or 1.0
+    expected_a = c * (a + b) / (c + d)
+    expected_b = d * (a + b) / (c + d)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 频数为0的项为0
+        ll = 2 * (np.where(a > 0, a * np.log(a / expected_a), 0.0) + np.where(b > 0, b * np.log(b / expected_b), 0.0))
+        sign = np.where(a / c >= b / d, 1.0, -1.0)
+        per_million_a = a / c * 1e6
+        per_million_b = np.where(b > 0, b / d * 1e6, ZERO_PER_MILLION)
+        percent_diff = np.where(a + b > 0, (per_million_a - per_million_b) / per_million_b * 100, 0.0)
+        log_ratio = np.log2((np.where(a > 0, a, 0.5) / c) / (np.where(b > 0, b, 0.5) / d))
+    return {'log_likelihood': sign * ll, 'percent_diff': percent_diff, 'log_ratio': log_ratio}
+
+
+def _books(matrix, part):
+    if isinstance(part, str):
+        if part not in FIELDS:
+            raise ValueError(f'Unknown field: {part}')
+        return [book for book in matrix.books if book[0] == part]
+    return [tuple(book) for book in part]
+
+
+def _field_counts(target, reference):
+    # 还没有生成CountMatrix时用领域的词频表，按词表的并集对齐
+    if not isinstance(target, str) or not isinstance(reference, str):
+        raise ValueError('Comparing books or the rest of the corpus needs the count matrix (run preprocess.py)')
+    freqs = [cached_table('word_freq', part).dropna(subset=['word']).groupby('word')['freq'].sum()
+             for part in (target, reference)]
+    vocab = freqs[0].index.union(freqs[1].index)
+    counts = []
+    for freq in freqs:
+        vector = np.zeros(len(vocab), dtype=np.int64)
+        vector[vocab.get_indexer(freq.index)] = freq.to_numpy()
+        counts.append(vector)
+    return np.asarray(vocab, dtype=object), counts[0], counts[1]
+
+
+def compare(target, reference=None):
+    """
+        计算所有词的关键性
+        :param target: 领域名，或书的列表 [(领域, 书名)]
+        :param reference: 领域名，书的列表，或None（语料库中除target以外的所有书）
+        :return: DataFrame，列为 word, freq_target, freq_reference, per_million_target,
+                 per_million_reference 和 MEASURES；只包含在其中一边出现过的词
+    """
+    matrix = load_matrix()
+    if matrix is None:
+        vocab, a, b = _field_counts(target, reference)
+    else:
+        target_books = _books(matrix, target)
+        if reference is None:
+            chosen = set(target_books)
+            reference_books = [book for book in matrix.books if book not in chosen]
+        else:
+            reference_books = _books(matrix, reference)
+        vocab = np.array(matrix.vocab, dtype=object)
+        a = matrix.word_counts(target_books)
+        b = matrix.word_counts(reference_books)
+
+    ids = np.flatnonzero((a + b) > 0)
+    a = a[ids]
+    b = b[ids]
+    df = pd.DataFrame({'word': vocab[ids], 'freq_target': a, 'freq_reference': b,
+                       'per_million_target': a / max(a.sum(), 1) * 1e6,
+                       'per_million_reference': b / max(b.sum(), 1) * 1e6})
+    for measure, values in scores(a, b).items():
+        df[measure] = values
+    return df
+
+
+def cached_compare(target, reference=None):
+    """
+        同compare，结果留在进程内的数据缓存中（CountMatrix更新后重新计算），翻页时不再重复计算
+        :return: DataFrame（共享对象，调用方不要原地修改）
+    """
+    if load_matrix() is None:
+        return compare(target, reference)
+    parts = json.dumps([target, reference], ensure_ascii=False)
+    key = f'{COUNTS_META}#keyness:{hashlib.sha1(parts.encode("utf-8")).hexdigest()}'
+    return cache.get(COUNTS_META, lambda: compare(target, reference), key=key)
+
+
+def keywords(table, direction='positive', sort_by='log_likelihood', min_frequency=1, min_log_likelihood=3.84):
+    """
+        :param table: compare()的结果
+        :param direction: positive（在目标语料中更常用）或 negative（在参照语料中更常用）
+        :param sort_by: MEASURES之一
+        :param min_frequency: 目标语料（negative时为参照语料）中的最低频数
+        :param min_log_likelihood: 对数似然比绝对值的下限（见CRITICAL_VALUES）
+        :return: DataFrame，按sort_by排序（negative时从最负的开始），索引为名次（rank，从1开始）
+    """
+    if sort_by not in MEASURES:
+        raise ValueError(f'Unknown measure: {sort_by}')
+    ll = table['log_likelihood'].to_numpy()
+    if direction == 'positive':
+        mask = (ll > 0) & (ll >= min_log_likelihood) & (table['freq_target'].to_numpy() >= min_frequency)
+        return rank_ordered(table[mask], sort_by)
+    if direction == 'negative':
+        mask = (ll < 0) & (-ll >= min_log_likelihood) & (table['freq_reference'].to_numpy() >= min_frequency)
+        ranked = rank_ordered(table[mask].assign(_order=lambda df: -df[sort_by]), '_order')
+        return ranked.drop(columns='_order')
+    raise ValueError(f'Unknown direction: {direction}')
@@ -0,0 +1,171 @@
+"""
+    Long-lived NLP models shared by every Streamlit session in the process.
+
+    Each model is loaded once, the first time it is used, and all parse requests go through one worker
+    thread per model. Requests that arrive while the worker is busy are parsed together as one batch
+    (nlp.pipe for spaCy), which also keeps models that are not thread-safe on a single thread.
+
+    Backends:
+        spacy    spacy.load('en_core_web_sm'), returns Doc objects
+        corenlp  StanfordCoreNLP(r'.\\stanfordnlp'), returns constituency parse strings
+        local    regex tokenizer returning flat parse strings in the CoreNLP format; used instead of
+                 corenlp when CORPUS_NLP_BACKEND=local, so the pages and scripts run without Java
+"""
+import os
+import re
+import queue
+import atexit
+import threading
+from concurrent.futures import Future
+
+from diagnostics import span
+
+SPACY_MODEL = os.environ.get('CORPUS_SPACY_MODEL', 'en_core_web_sm')
+CORENLP_PATH = os.environ.get('CORPUS_CORENLP_PATH', os.path.join('.', 'stanfordnlp'))
+
+
+class SpacyBackend:
+    def __init__(self, name=SPACY_MODEL, batch_size=64):
+        import spacy
+        self.model = spacy.load(name)
+        self.batch_size = batch_size
+
+    def process(self, texts):
+        return list(self.model.pipe(texts, batch_size=self.batch_size))
+
+    def close(self):
+        pass
+
+
+class CoreNLPBackend:
+    def __init__(self, path=CORENLP_PATH):
+        from stanfordcorenlp import StanfordCoreNLP
+        self.model = StanfordCoreNLP(path, lang='en')
+
+    def process(self, texts):
+        return [self.model.parse(text) for text in texts]
+
+    def close(self):
+        self.model.close()
+
+
+class LocalBackend:
+    token_pattern = re.compile(r"\w+(?:[-']\w+)*|[^\w\s]")
+
+    def __init__(self):
+        self.model = None
+
+    def process(self, texts):
+        results = []
+        for text in texts:
+            tokens = [t.replace('(', '-LRB-').replace(')', '-RRB-') for t in self.token_pattern.findall(text)]
+            results.append('(ROOT (S ' + ' '.join(f'(X {t})' for t in tokens) + '))')
+        return results
+
+    def close(self):
+        pass
+
+
+BACKENDS = {
+    'spacy': SpacyBackend,
+    'corenlp': CoreNLPBackend,
+    'local': LocalBackend,
+}
+
+
+class ModelService:
+    """
+        一个模型的后台线程：排队的请求合并成一批处理
+        :param backend_factory: 无参数函数，返回backend（第一次使用时才调用）
+        :param max_batch: 每批最多的文本数
+    """
+
+    def __init__(self, backend_factory, max_batch=256, name='model'):
+        self.name = name
+        self._factory = backend_factory
+        self._backend = None
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._load_lock = threading.Lock()
+        self._worker = None
+
+    @property
+    def model(self):
+        return self._load().model
+
+    def _load(self):
+        with self._load_lock:
+            if self._backend is None:
+                self._backend = self._factory()
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            return self._backend
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            while size < self._max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            texts = [text for texts, _ in batch for text in texts]
+            try:
+                results = self._backend.process(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for texts, future in batch:
+                future.set_result(results[start:start + len(texts)])
+                start += len(texts)
+
+    def submit(self, texts):
+        """
+            提交一组文本，返回Future，结果为与texts一一对应的列表
+        """
+        self._load()
+        future = Future()
+        self._queue.put((list(texts), future))
+        return future
+
+    def parse_many(self, texts, timeout=None):
+        with span(f'model.{self.name}'):
+            return self.submit(texts).result(timeout)
+
+    def parse(self, text, timeout=None):
+        return self.parse_many([text], timeout)[0]
+
+    def close(self):
+        with self._load_lock:
+            if self._backend is not None:
+                self._backend.close()
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_service(kind):
+    """
+        取一个进程内共享的模型服务
+        :param kind: 'spacy' 或 'corenlp'（CORPUS_NLP_BACKEND=local时corenlp由local代替）
+        :return: ModelService
+    """
+    if kind == 'corenlp' and os.environ.get('CORPUS_NLP_BACKEND') == 'local':
+        kind = 'local'
+    with _services_lock:
+        if kind not in _services:
+            _services[kind] = ModelService(BACKENDS[kind], name=kind)
+        return _services[kind]
+
+
+@atexit.register
+def _close_all():
+    # 关闭CoreNLP启动的Java进程
+    for service in list(_services.values()):
+        service.close()
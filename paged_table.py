@@ -0,0 +1,81 @@
+"""
+    Server-side paging for the large tables on the pages.
+
+    st.dataframe serialises every row it is given and sends it to the browser, which for a field's
+    whole vocabulary or an unbounded search result is megabytes per table. view() filters and sorts on
+    the server, page_of() cuts out the one page that is shown, and locate() finds the page holding a
+    given rank, row number or word, so the browser only ever receives page_size rows. FrameView wraps
+    a filtered frame in the same len()/page()/locate() interface as the views of corpus_store.py.
+"""
+import numpy as np
+
+PAGE_SIZE = 50
+
+
+def rank_ordered(df, by='freq'):
+    """
+        :return: 按by从高到低排序的副本，索引为名次（从1开始，名称为rank）
+    """
+    ranked = df.sort_values(by, ascending=False, kind='stable').reset_index(drop=True)
+    ranked.index = ranked.index + 1
+    ranked.index.name = 'rank'
+    return ranked
+
+
+def view(df, sort_by=None, ascending=True, contains=None, column=None):
+    """
+        筛选并排序
+        :param sort_by: 排序的列名或索引名，None时保持原来的顺序
+        :param contains: 只保留column中包含该字符串的行（不区分大小写）
+        :return: DataFrame
+    """
+    if contains and column:
+        df = df[df[column].str.contains(contains, case=False, regex=False, na=False)]
+    if sort_by and sort_by != df.index.name:
+        df = df.sort_values(sort_by, ascending=ascending, kind='stable')
+    elif sort_by and not ascending:
+        df = df.iloc[::-1]
+    return df
+
+
+def page_count(total, page_size=PAGE_SIZE):
+    return max(1, -(-total // page_size))
+
+
+def page_of(df, page=0, page_size=PAGE_SIZE):
+    """
+        :param page: 页码，从0开始
+        :return: 这一页的行
+    """
+    start = page * page_size
+    return df.iloc[start:start + page_size]
+
+
+def locate(df, target, column=None):
+    """
+        查找目标所在的位置：数字按索引（名次或行号）查找，其他按column的值查找
+        :return: 在df中的位置（从0开始），找不到时返回None
+    """
+    target = str(target).strip()
+    if target.isdigit():
+        hits = np.flatnonzero(df.index.to_numpy() == int(target))
+    elif column:
+        hits = np.flatnonzero((df[column] == target).to_numpy())
+    else:
+        return None
+    return int(hits[0]) if len(hits) else None
+
+
+class FrameView:
+    def __init__(self, df, column=None):
+        self.df = df
+        self.column = column
+
+    def __len__(self):
+        return len(self.df)
+
+    def page(self, page=0, page_size=PAGE_SIZE):
+        return page_of(self.df, page, page_size)
+
+    def locate(self, target):
+        return locate(self.df, target, self.column)
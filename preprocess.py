@@ -0,0 +1,610 @@
+"""
+    Rebuild every corpus artifact from the raw texts under .\\book.
+
+    The texts are laid out as book\\<field>\\<title>.txt. The pipeline has two parallel stages:
+
+    1. One task per book (multiprocessing across all cores): split sentences, tokenize and POS-tag
+       with nltk, count words, (word, pos) pairs, POS tags and n-grams, and write the counts and the
+       tagged sentences of that book to .\\corpus_build\\<field>\\<title>.pkl.
+    2. One task per field: merge the book files of the field and write the xlsx files and word cloud
+       read by the pages. The n-gram counts are written to corpora_data.db by the main process.
+
+    Finally the per-book count matrix (subcorpus.py), the columnar files (columnar.py), the shared
+    memory-mapped corpus store (corpus_store.py) and the SQLite search indexes (search_index.py,
+    with the collocation scores of association.py) are rebuilt. Feature tables for the Overview page
+    need lingfeat and are only rebuilt with --features.
+
+    The per-book counts and the field totals are kept in .\\corpus_build, so a book can later be
+    added or removed by adding or subtracting its own counts (add / remove / sync) instead of
+    recounting its field. Counting the book and updating the word index, n-gram tables and sentence
+    index take time proportional to the book. Rewriting the files of a changed field is still
+    proportional to the field (its xlsx files, sentence workbook, word cloud, summaries and
+    collocation scores, which all depend on the field totals), as is saving the count matrix and the
+    corpus store; these are done once per field at the end of a command, however many books it adds
+    or removes. A field that was not built by preprocess.py (no saved totals) has to be rebuilt with
+    a full build first.
+
+    Usage:
+        python -m nltk.downloader punkt averaged_perceptron_tagger
+        python preprocess.py [--processes N] [--max-n 5] [--features]
+        python preprocess.py add book\\Business\\<title>.txt
+        python preprocess.py remove book\\Business\\<title>.txt
+        python preprocess.py sync
+"""
+import os
+import re
+import pickle
+import sqlite3
+import argparse
+from collections import Counter
+from multiprocessing import Pool
+
+import pandas as pd
+
+import columnar
+import association
+import corpus_store
+import search_index
+import sentence_features
+from catalog import field_of
+from db_pool import FEATURE_TABLES, enable_wal
+from columnar import FIELDS
+from subcorpus import CountMatrix, load_matrix
+
+BOOK_DIR = os.path.join('.', 'book')
+BUILD_DIR = os.path.join('.', 'corpus_build')
+STOPWORDS = os.path.join('.', 'stopwords.txt')
+WORDCLOUD_PATH = os.path.join('.', 'wordcloud', '{field}.png')
+DB_PATH = search_index.DB_PATH
+
+
+def find_books(book_dir=BOOK_DIR):
+    """
+        遍历book文件夹，找到所有书
+        :param book_dir: 书的存放位置
+        :return: [(领域, 书名, 路径)]
+    """
+    books = []
+    for roots, dirs, files in os.walk(book_dir):
+        for file in sorted(files):
+            path = os.path.join(roots, file)
+            field = field_of(path, book_dir)
+            if field is not None and file.endswith('.txt'):
+                books.append((field, file[:-4], path))
+    return books
+
+
+def partial_path(field, title):
+    return os.path.join(BUILD_DIR, field, f'{title}.pkl')
+
+
+def total_path(field):
+    return os.path.join(BUILD_DIR, field, '_total.pkl')
+
+
+def count_book(text, max_n=5):
+    """
+        统计一本书
+        :param text: 全文
+        :param max_n: n元组的最大长度
+        :return: 可以相加的统计结果（见merge_partials）
+    """
+    import nltk
+
+    words = Counter()
+    word_pos = Counter()
+    pos = Counter()
+    n_grams = Counter()
+    sentences = []
+    tokens = 0
+    for sentence in nltk.sent_tokenize(text):
+        sentence = ' '.join(sentence.split())
+        tagged = nltk.pos_tag(nltk.word_tokenize(sentence))
+        sentences.append((sentence, str(tagged), len(tagged)))
+        sen_words = []
+        for token, tag in tagged:
+            if token.isalpha():
+                word = token.lower()
+                sen_words.append(word)
+                words[word] += 1
+                word_pos[(word, tag)] += 1
+                pos[tag] += 1
+        tokens += len(sen_words)
+        for n in range(2, max_n + 1):
+            for i in range(len(sen_words) - n + 1):
+                n_grams[(' '.join(sen_words[i:i + n]), n)] += 1
+    return {
+        'words': words,
+        'word_pos': word_pos,
+        'pos': pos,
+        'ngrams': n_grams,
+        'tokens': tokens,
+        'sentences': sentences,
+    }
+
+
+def process_book(args):
+    field, title, path, max_n = args
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        partial = count_book(f.read(), max_n)
+    partial.update(field=field, title=title, source=path,
+                   mtime=os.path.getmtime(path), size=os.path.getsize(path))
+    target = partial_path(field, title)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target + '.tmp', 'wb') as f:
+        pickle.dump(partial, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(target + '.tmp', target)
+    return field, title, partial['tokens']
+
+
+def load_partial(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def empty_total():
+    return {'words': Counter(), 'word_pos': Counter(), 'pos': Counter(), 'tokens': 0, 'books': {}}
+
+
+def book_entry(partial, sheet):
+    return {'source': partial['source'], 'mtime': partial['mtime'], 'size': partial['size'],
+            'sheet': sheet, 'sentences': len(partial['sentences'])}
+
+
+def apply_partial(total, partial, sign=1):
+    """
+        把一本书的统计结果加到领域的统计结果上（sign=-1时减去）
+    """
+    for key in ('words', 'word_pos', 'pos'):
+        if sign > 0:
+            total[key].update(partial[key])
+        else:
+            total[key].subtract(partial[key])
+            total[key] = Counter({k: c for k, c in total[key].items() if c > 0})
+    total['tokens'] += sign * partial['tokens']
+
+
+def merge_partials(paths):
+    """
+        合并多本书的统计结果
+        :param paths: 每本书的统计文件
+        :return: (统计结果, n元组统计, [每本书的统计结果])
+    """
+    total = empty_total()
+    n_grams = Counter()
+    books = []
+    for path in paths:
+        partial = load_partial(path)
+        apply_partial(total, partial)
+        n_grams.update(partial['ngrams'])
+        books.append(partial)
+    names = sheet_names([partial['title'] for partial in books])
+    total['books'] = {partial['title']: book_entry(partial, names[partial['title']]) for partial in books}
+    return total, n_grams, books
+
+
+def load_total(field):
+    if not os.path.exists(total_path(field)):
+        return empty_total()
+    return load_partial(total_path(field))
+
+
+def check_total(field):
+    """
+        增加或删除书之前检查：领域已经有数据文件却没有保存的统计结果时（不是由preprocess.py build生成的），
+        不能在一本书的统计上更新，否则会用这一本书的结果覆盖整个领域
+    """
+    if not os.path.exists(total_path(field)) and os.path.exists(columnar.source_path('word_freq', field)):
+        raise ValueError(f'{field} has corpus files but no saved totals in {BUILD_DIR}; '
+                         f'run python preprocess.py build once before adding or removing books')
+
+
+def save_total(field, total):
+    path = total_path(field)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(total, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def sheet_names(titles, used=()):
+    # Excel工作表名最多31个字符，不能包含[]:*?/\，且不能重复
+    names = {}
+    used = {name.lower() for name in used}
+    for title in titles:
+        base = re.sub(r'[\[\]:*?/\\]', '', title).strip()[:31].strip() or 'book'
+        name, i = base, 1
+        while name.lower() in used:
+            suffix = f'~{i}'
+            name, i = base[:31 - len(suffix)] + suffix, i + 1
+        used.add(name.lower())
+        names[title] = name
+    return names
+
+
+def _write_xlsx(df, path, **kwargs):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_excel(path, index=False, **kwargs)
+
+
+def write_word_artifacts(field, total):
+    words = pd.DataFrame(list(total['words'].items()), columns=['word', 'freq'])
+    words = words.sort_values(['freq', 'word'], ascending=[False, True], ignore_index=True)
+    words['word_lengths'] = words['word'].str.len()
+    _write_xlsx(words, columnar.source_path('word_freq', field))
+    columnar.write_artifact('word_freq', words, field)
+
+    cumulative = words[['word', 'freq']].copy()
+    cumulative['cumulative_freq'] = cumulative['freq'].cumsum()
+    _write_xlsx(cumulative, columnar.source_path('cumulative_word_frequency', field))
+    columnar.write_artifact('cumulative_word_frequency', cumulative, field)
+
+    word_pos = pd.DataFrame([(w, p, c) for (w, p), c in total['word_pos'].items()],
+                            columns=['word', 'pos_tag', 'count'])
+    word_pos = word_pos.sort_values(['count', 'word'], ascending=[False, True], ignore_index=True)
+    _write_xlsx(word_pos, columnar.source_path('word_attribute', field))
+    columnar.write_artifact('word_attribute', word_pos, field)
+
+    pos = pd.DataFrame(list(total['pos'].items()), columns=['pos_tag', 'count'])
+    pos = pos.sort_values('count', ascending=False, ignore_index=True)
+    pos['percentage(%)'] = pos['count'] / max(pos['count'].sum(), 1) * 100
+    _write_xlsx(pos, columnar.source_path('pos_proportion', field))
+    columnar.write_artifact('pos_proportion', pos, field)
+
+
+SENTENCE_COLUMNS = ['sentences', 'tagged', 'length']
+
+
+def write_sentences(field, books, names):
+    path = columnar.SENTENCES_XLSX.format(field=field)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with pd.ExcelWriter(path) as writer:
+        for title, sentences in books:
+            df = pd.DataFrame(sentences, columns=SENTENCE_COLUMNS)
+            df.to_excel(writer, sheet_name=names[title], index=False)
+
+
+def replace_sentence_sheets(field, sheets):
+    """
+        在句子工作簿中增加、替换或删除多本书的工作表（整个工作簿只读写一次）
+        :param sheets: {工作表名: 句子}，句子为None时删除该工作表
+    """
+    from openpyxl import Workbook, load_workbook
+
+    if not sheets:
+        return
+    path = columnar.SENTENCES_XLSX.format(field=field)
+    if os.path.exists(path):
+        workbook = load_workbook(path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        workbook = Workbook()
+        workbook.remove(workbook.active)
+    for sheet, sentences in sheets.items():
+        if sheet in workbook.sheetnames:
+            del workbook[sheet]
+        if sentences is not None:
+            worksheet = workbook.create_sheet(sheet)
+            worksheet.append(SENTENCE_COLUMNS)
+            for row in sentences:
+                worksheet.append(list(row))
+    if workbook.sheetnames:
+        workbook.save(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def read_stopwords(path=STOPWORDS):
+    with open(path, encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def write_wordcloud(field, freqs, stopwords):
+    import wordcloud
+
+    freqs = {w: c for w, c in freqs.items() if w not in stopwords}
+    if not freqs:
+        return
+    path = WORDCLOUD_PATH.format(field=field)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    wordcloud.WordCloud(width=800, height=600, background_color='white', max_words=200) \
+        .generate_from_frequencies(freqs).to_file(path)
+
+
+def build_field(args):
+    """
+        合并一个领域的所有书并写出该领域的文件
+        :return: (领域, 基本信息, n元组统计文件, [(领域, 书名, 词频, 词性)])
+    """
+    field, paths = args
+    total, counts, books = merge_partials(paths)
+    write_word_artifacts(field, total)
+    write_sentences(field, [(partial['title'], partial['sentences']) for partial in books],
+                    {title: entry['sheet'] for title, entry in total['books'].items()})
+    write_wordcloud(field, total['words'], read_stopwords())
+    save_total(field, total)
+
+    n_grams = os.path.join(BUILD_DIR, field, '_ngrams.pkl')
+    with open(n_grams, 'wb') as f:
+        pickle.dump(counts, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return field, field_info(total), n_grams, [(field, p['title'], p['words'], p['pos']) for p in books]
+
+
+def field_info(total):
+    types = len(total['words'])
+    sentences = sum(entry['sentences'] for entry in total['books'].values())
+    return {
+        'Type': types,
+        'Token': total['tokens'],
+        'TTR': types / total['tokens'] if total['tokens'] else 0.0,
+        'books': len(total['books']),
+        'sentences': sentences,
+    }
+
+
+def write_ngrams(connection, field, n_grams):
+    table = f'n_grams_{field}'
+    connection.execute(f"drop table if exists {table}")
+    connection.execute(f"create table {table} (field1 text, field2 integer, field3 integer)")
+    connection.executemany(f"insert into {table} (field1, field2, field3) values (?, ?, ?)",
+                           ((text, count, n) for (text, n), count in n_grams.items()))
+    connection.execute(f"create index {table}_key on {table} (field1, field3)")
+    connection.commit()
+
+
+def write_summaries(infos, update=False):
+    """
+        写basic_information和sentences_total_attribute
+        :param infos: {领域: field_info}
+        :param update: True时只替换这些领域的行，保留其他领域
+    """
+    basic = pd.DataFrame({field: {k: info[k] for k in ('Type', 'Token', 'TTR')} for field, info in infos.items()}).T
+    total = pd.DataFrame([{'field': field, 'books': info['books'], 'sentences': info['sentences'],
+                           'tokens': info['Token'],
+                           'mean_sentence_length': info['Token'] / info['sentences'] if info['sentences'] else 0.0}
+                          for field, info in infos.items()])
+    basic_path = columnar.source_path('basic_information')
+    total_path_ = columnar.source_path('sentences_total_attribute')
+    if update and os.path.exists(basic_path):
+        old = pd.read_excel(basic_path, index_col=0)
+        basic = pd.concat([old.drop(index=[f for f in infos if f in old.index]), basic])
+    if update and os.path.exists(total_path_):
+        old = pd.read_excel(total_path_)
+        total = pd.concat([old[~old.field.isin(list(infos))], total], ignore_index=True)
+    basic = basic.loc[[f for f in FIELDS if f in basic.index]]
+
+    os.makedirs(os.path.dirname(basic_path), exist_ok=True)
+    basic.to_excel(basic_path)
+    columnar.write_artifact('basic_information', basic)
+    _write_xlsx(total, total_path_)
+    columnar.write_artifact('sentences_total_attribute', total)
+
+
+def book_features(path):
+    from lingfeat import extractor
+
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        features = extractor.pass_text(f.read())
+    features.preprocess()
+    result = {}
+    for table in FEATURE_TABLES:
+        result.update(getattr(features, f'{table}_')())
+    return result
+
+
+def write_features(connection, books, pool):
+    """
+        用lingfeat计算每本书的特征，按领域取平均值写入数据库；保留原表中的Definition行
+    """
+    rows = pool.map(book_features, [path for _, _, path in books])
+    df = pd.DataFrame(rows)
+    df['field'] = [field for field, _, _ in books]
+    means = df.groupby('field').mean()
+    for table in FEATURE_TABLES:
+        columns = [col for col in means.columns if col.startswith(table)]
+        definitions = {col: col for col in columns}
+        if search_index.has_table(connection, table):
+            old = pd.read_sql(f"select * from {table} where field1 = 'Definition'", connection)
+            if len(old):
+                definitions.update({col: old.at[0, col] for col in columns if col in old.columns})
+        out = means[columns].astype(str)
+        out.loc['Definition'] = pd.Series(definitions)
+        out.index.name = 'field1'
+        out.reset_index().to_sql(table, connection, if_exists='replace', index=False)
+    connection.commit()
+
+
+def run(book_dir=BOOK_DIR, processes=None, max_n=5, features=False, log=print):
+    books = find_books(book_dir)
+    if not books:
+        log(f'No books found under {book_dir}')
+        return
+    fields = sorted({field for field, _, _ in books}, key=FIELDS.index)
+
+    with Pool(processes) as pool:
+        for field, title, tokens in pool.imap_unordered(process_book, [b + (max_n,) for b in books]):
+            log(f'{field}: {title} ({tokens} tokens)')
+
+        jobs = [(field, [partial_path(f, t) for f, t, _ in books if f == field]) for field in fields]
+        infos = {}
+        book_counts = {}
+        connection = sqlite3.connect(DB_PATH)
+        enable_wal(connection)
+        for field, info, n_grams, counts in pool.imap_unordered(build_field, jobs):
+            infos[field] = info
+            book_counts[field] = counts
+            write_ngrams(connection, field, load_partial(n_grams))
+            os.remove(n_grams)
+            log(f'{field}: artifacts written')
+        write_summaries({field: infos[field] for field in fields})
+        CountMatrix.from_partials([book for field in fields for book in book_counts[field]]).save()
+
+        if features:
+            write_features(connection, books, pool)
+            log('feature tables written')
+
+    columnar.compile_corpus(fields, log=log)
+    corpus_store.build_store(log=log)
+    search_index.build_word_index(connection, fields, log=log)
+    search_index.build_collocation_index(connection, fields, log=log)
+    association.build_association_scores(connection, fields, log=log)
+    search_index.build_sentence_index(connection, fields, log=log)
+    connection.close()
+
+
+class Changes:
+    """
+        一批增加和删除的书。每本书只做与这本书大小成正比的工作（统计这本书，更新数据库中的差值，写这本书的
+        句子）；需要重写整个领域的文件（xlsx、词云、汇总、句子工作簿、词组关联度）和整个语料库的文件
+        （CountMatrix、corpus store）在flush()中对每个领域只做一次
+    """
+
+    def __init__(self):
+        self.totals = {}  # 领域 -> 统计结果
+        self.sheets = {}  # 领域 -> {工作表名: 句子，None表示删除}
+        self._matrix = None
+
+    def total(self, field):
+        if field not in self.totals:
+            check_total(field)
+            self.totals[field] = load_total(field)
+        return self.totals[field]
+
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = load_matrix() or CountMatrix.empty()
+        return self._matrix
+
+    def flush(self, connection, log=print):
+        # 只重写增加或删除过书的领域
+        for field, sheets in self.sheets.items():
+            total = self.totals[field]
+            replace_sentence_sheets(field, sheets)
+            columnar.update_sentence_sheets(
+                field, added={sheet: pd.DataFrame(sentences, columns=SENTENCE_COLUMNS)
+                              for sheet, sentences in sheets.items() if sentences is not None},
+                removed=[sheet for sheet, sentences in sheets.items() if sentences is None])
+            write_word_artifacts(field, total)
+            write_wordcloud(field, total['words'], read_stopwords())
+            write_summaries({field: field_info(total)}, update=True)
+            columnar.build_summary_cube([field], log=lambda *args: None)
+            association.build_association_scores(connection, [field], log=lambda *args: None)
+            save_total(field, total)
+            log(f'{field}: files rewritten')
+        if self._matrix is not None:
+            self._matrix.save()
+        if self.sheets:
+            # 词表是所有领域共用的
+            corpus_store.build_store(log=lambda *args: None)
+        self.totals.clear()
+        self.sheets.clear()
+        self._matrix = None
+
+
+def add_book(connection, path, book_dir=BOOK_DIR, max_n=5, log=print, changes=None):
+    """
+        增加（或更新）一本书：只统计这本书，再把结果加到领域的统计结果上
+        :param connection: 数据库连接
+        :param path: 书的路径，book\\<领域>\\<书名>.txt
+        :param changes: Changes，批量处理时由调用方最后flush；None时立即写出
+    """
+    field = field_of(path, book_dir)
+    if field is None:
+        raise ValueError(f'{path} is not in a field directory under {book_dir}')
+    batch = changes or Changes()
+    title = os.path.basename(path)[:-4]
+    total = batch.total(field)
+    if title in total['books']:
+        remove_book(connection, path, book_dir, log=log, changes=batch)
+
+    process_book((field, title, path, max_n))
+    partial = load_partial(partial_path(field, title))
+    apply_partial(total, partial)
+    sheet = sheet_names([title], used=[entry['sheet'] for entry in total['books'].values()])[title]
+    total['books'][title] = book_entry(partial, sheet)
+
+    batch.sheets.setdefault(field, {})[sheet] = partial['sentences']
+    search_index.update_word_index(connection, field, partial['word_pos'])
+    search_index.update_ngrams(connection, field, partial['ngrams'])
+    search_index.add_sentences(connection, field, sheet, partial['sentences'])
+    batch.matrix().add_book(field, title, partial['words'], partial['pos'])
+    log(f'{field}: added {title} ({partial["tokens"]} tokens)')
+    if changes is None:
+        batch.flush(connection, log=log)
+
+
+def remove_book(connection, path, book_dir=BOOK_DIR, log=print, changes=None):
+    """
+        删除一本书：从领域的统计结果中减去这本书的统计结果
+        :param connection: 数据库连接
+        :param path: 书的路径（文件可以已经不存在）
+        :param changes: 同add_book
+    """
+    field = field_of(path, book_dir)
+    title = os.path.basename(path)[:-4]
+    batch = changes or Changes()
+    total = batch.total(field) if field else empty_total()
+    if title not in total['books']:
+        log(f'{path} is not in the corpus')
+        return
+    entry = total['books'].pop(title)
+    partial = load_partial(partial_path(field, title))
+    apply_partial(total, partial, -1)
+
+    batch.sheets.setdefault(field, {})[entry['sheet']] = None
+    search_index.update_word_index(connection, field, partial['word_pos'], -1)
+    search_index.update_ngrams(connection, field, partial['ngrams'], -1)
+    search_index.remove_sentences(connection, field, entry['sheet'])
+    sentence_features.remove_book(connection, field, entry['sheet'])
+    batch.matrix().remove_book(field, title)
+    os.remove(partial_path(field, title))
+    log(f'{field}: removed {title}')
+    if changes is None:
+        batch.flush(connection, log=log)
+
+
+def sync(connection, book_dir=BOOK_DIR, max_n=5, log=print):
+    """
+        对比book文件夹和已统计的书：删除不存在的书，增加新的或修改过的书；领域的文件在最后一起重写
+    """
+    books = {(field, title): path for field, title, path in find_books(book_dir)}
+    changes = Changes()
+    for field in FIELDS:
+        if not os.path.exists(total_path(field)):
+            continue
+        for title, entry in list(changes.total(field)['books'].items()):
+            path = books.get((field, title))
+            if path is None or os.path.getmtime(path) != entry['mtime'] or os.path.getsize(path) != entry['size']:
+                remove_book(connection, entry['source'], book_dir, log=log, changes=changes)
+    for (field, title), path in books.items():
+        if title not in changes.total(field)['books']:
+            add_book(connection, path, book_dir, max_n, log=log, changes=changes)
+    changes.flush(connection, log=log)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild all corpus artifacts from the book directory')
+    parser.add_argument('command', nargs='?', default='build', choices=['build', 'add', 'remove', 'sync'],
+                        help='build: rebuild everything; add/remove: update the given books only; '
+                             'sync: add/remove the books that changed under --book-dir')
+    parser.add_argument('paths', nargs='*', help='book files for add/remove')
+    parser.add_argument('--book-dir', default=BOOK_DIR)
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--max-n', type=int, default=5, help='longest n-gram to count')
+    parser.add_argument('--features', action='store_true', help='also rebuild the lingfeat feature tables')
+    args = parser.parse_args()
+    if args.command == 'build':
+        run(args.book_dir, args.processes, args.max_n, args.features)
+    else:
+        conn = sqlite3.connect(DB_PATH)
+        enable_wal(conn)
+        if args.command == 'sync':
+            sync(conn, args.book_dir, args.max_n)
+        pending = Changes()
+        for book in args.paths:
+            if args.command == 'add':
+                add_book(conn, book, args.book_dir, args.max_n, changes=pending)
+            elif args.command == 'remove':
+                remove_book(conn, book, args.book_dir, changes=pending)
+        pending.flush(conn)
+        conn.close()
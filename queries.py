@@ -0,0 +1,265 @@
+"""
+    The lookups behind the pages, without Streamlit.
+
+    Each function takes plain arguments and returns a DataFrame (or a DataFrame and a total count for
+    paged results). They read through the same process-wide data cache (data_cache.py) and read-only
+    connection pool (db_pool.py) as the pages, so the pages, scripts and the HTTP service
+    (query_server.py) share one set of loaded tables and open connections.
+
+    run() and run_batch() call the lookups by name, which is how the HTTP service exposes them:
+
+        import queries
+        queries.run('word', {'word': 'market', 'fields': ['Business']})
+        queries.run_batch([{'query': 'collocations', 'params': {'field': 'History', 'word': 'war'}}, ...])
+
+    A bad query name or parameter raises BadRequest (a ValueError); any other exception is a failure
+    of the data or the code, which query_server.py tells apart from bad requests.
+"""
+import os
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from columnar import FIELDS, load_table
+from corpus_store import field_store, open_store
+from data_cache import ranked_table
+from db_pool import FEATURE_TABLES, pool
+from keyness import MEASURES as KEYNESS_MEASURES, cached_compare, keywords as rank_keywords
+from paged_table import PAGE_SIZE, page_of, view
+from search_index import MEASURES as COLLOCATION_MEASURES, has_table, lookup_word, search_sentences, top_collocations
+from sentence_store import load_books
+
+_batch = ThreadPoolExecutor(int(os.environ.get('CORPUS_QUERY_THREADS', 8)), thread_name_prefix='queries')
+
+
+SENTENCE_MODES = ('substring', 'token', 'phrase', 'prefix')
+
+
+class BadRequest(ValueError):
+    """
+        查询名或参数不正确（调用方的错误，重试也不会成功）
+    """
+
+
+def _field(field):
+    if not isinstance(field, str) or field not in FIELDS:
+        raise BadRequest(f'Unknown field: {field}')
+    return field
+
+
+def _text(value, name):
+    if not isinstance(value, str):
+        raise BadRequest(f'{name} must be a string: {value!r}')
+    return value
+
+
+def _number(value, name, kind=int):
+    # JSON中的数字可能是字符串；bool不算数字
+    if isinstance(value, bool):
+        raise BadRequest(f'{name} must be a number: {value!r}')
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f'{name} must be a number: {value!r}') from None
+
+
+def _list(value, name):
+    if isinstance(value, (str, bytes, dict)) or not hasattr(value, '__iter__'):
+        raise BadRequest(f'{name} must be a list: {value!r}')
+    return list(value)
+
+
+def word(word, fields=None):
+    """
+        一个词在各领域中的词性和词频
+        :param fields: 领域列表，None表示所有领域
+        :return: DataFrame，列为 word, pos_tag, count, field
+    """
+    word = _text(word, 'word')
+    if fields is not None:
+        fields = [_field(field) for field in _list(fields, 'fields')]
+    if pool.run(has_table, 'word_index'):
+        return pool.run(lookup_word, word, fields)
+    frames = []
+    store = open_store()
+    for field in (FIELDS if fields is None else fields):
+        if store is not None and store.is_fresh(field):
+            frames.append(store.lookup(word, [field]))
+            continue
+        try:
+            df = load_table('word_attribute', field, where=ds.field('word') == word)
+        except FileNotFoundError:
+            continue
+        if len(df):
+            frames.append(df.assign(field=field))
+    if not frames:
+        return pd.DataFrame(columns=['word', 'pos_tag', 'count', 'field'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def word_frequencies(field, page=0, page_size=PAGE_SIZE, sort_by='rank', ascending=True, contains=None):
+    """
+        一个领域的词频表（分页）
+        :param sort_by: rank, word, freq 或 word_lengths
+        :param contains: 只保留包含该字符串的词
+        :return: (DataFrame，列为 rank, word, freq, word_lengths；符合条件的词数)
+    """
+    if sort_by not in (None, 'rank', 'word', 'freq', 'word_lengths'):
+        raise BadRequest(f'Unknown sort column: {sort_by}')
+    if contains is not None:
+        _text(contains, 'contains')
+    page, page_size = _number(page, 'page'), _number(page_size, 'page_size')
+    store = field_store(_field(field))
+    if store is not None:
+        shown = store.word_freq(field, sort_by, ascending, contains)
+        return shown.page(page, page_size).reset_index(), len(shown)
+    df = view(ranked_table('word_freq', field), sort_by, ascending, contains, 'word')
+    return page_of(df, page, page_size).reset_index(), len(df)
+
+
+def collocations(field, word, n=2, top=20, measure='frequency', min_frequency=1):
+    """
+        :param measure: frequency, pmi, log_likelihood, t_score 或 dice
+        :param min_frequency: 按关联度排序时的最低频率
+        :return: DataFrame，列为 Collocations, Frequency（按关联度排序时还有 Score），从高到低
+    """
+    if measure != 'frequency' and measure not in COLLOCATION_MEASURES:
+        raise BadRequest(f'Unknown measure: {measure}')
+    return pool.run(top_collocations, _field(field), _text(word, 'word'), _number(n, 'n'), _number(top, 'top'),
+                    measure, _number(min_frequency, 'min_frequency'))
+
+
+def _part(part):
+    # JSON中的书为 [领域, 书名] 列表
+    if part is None:
+        return None
+    if isinstance(part, str):
+        return _field(part)
+    books = []
+    for book in _list(part, 'books'):
+        if isinstance(book, str) or len(_list(book, 'book')) != 2:
+            raise BadRequest(f'A book must be [field, title]: {book!r}')
+        books.append((_field(book[0]), _text(book[1], 'title')))
+    return books
+
+
+def keywords(target, reference=None, direction='positive', sort_by='log_likelihood', page=0, page_size=PAGE_SIZE,
+             min_frequency=1, min_log_likelihood=3.84):
+    """
+        target相对于reference的关键词（分页）
+        :param target: 领域名，或书的列表 [[领域, 书名], ...]
+        :param reference: 同target；None表示语料库中的其他所有书
+        :param direction: positive 或 negative
+        :param sort_by: log_likelihood, percent_diff 或 log_ratio
+        :return: (DataFrame，列为 rank, word, freq_target, freq_reference, per_million_target,
+                 per_million_reference, log_likelihood, percent_diff, log_ratio；符合条件的词数)
+    """
+    if direction not in ('positive', 'negative'):
+        raise BadRequest(f'Unknown direction: {direction}')
+    if sort_by not in KEYNESS_MEASURES:
+        raise BadRequest(f'Unknown measure: {sort_by}')
+    min_frequency = _number(min_frequency, 'min_frequency')
+    min_log_likelihood = _number(min_log_likelihood, 'min_log_likelihood', float)
+    page, page_size = _number(page, 'page'), _number(page_size, 'page_size')
+    df = rank_keywords(cached_compare(_part(target), _part(reference)), direction, sort_by, min_frequency,
+                       min_log_likelihood)
+    return page_of(df, page, page_size).reset_index(), len(df)
+
+
+def sentences(text, mode='token', field=None, books=None, page=0, page_size=PAGE_SIZE):
+    """
+        查询句子
+        :param mode: substring（在所选的书中查找子串，需要field和books），token, phrase 或 prefix（全文索引）
+        :return: (DataFrame，列为 sentences, tagged, book, field；符合条件的句子总数)
+    """
+    text = _text(text, 'text')
+    if mode not in SENTENCE_MODES:
+        raise BadRequest(f'Unknown search mode: {mode}')
+    if field is not None:
+        _field(field)
+    if books is not None:
+        books = [_text(book, 'book') for book in _list(books, 'books')]
+    page, page_size = _number(page, 'page'), _number(page_size, 'page_size')
+    if mode == 'substring':
+        if field is None or books is None:
+            raise BadRequest('substring search needs a field and a list of books')
+        store = field_store(field)
+        if store is not None:
+            df, total = store.sentences(field, text, books, page, page_size)
+            return df.assign(field=field), total
+        df = load_books(field, books)
+        df = df[df.sentences.str.contains(text, regex=False, na=False)].assign(field=field)
+        return page_of(df.reset_index(drop=True), page, page_size), len(df)
+    return pool.run(search_sentences, text, mode, field=field, books=books, page=page, page_size=page_size)
+
+
+def feature_table(name):
+    """
+        Overview页面的lingfeat特征表
+        :param name: FEATURE_TABLES中的表名，如 WoKF
+    """
+    if name not in FEATURE_TABLES:
+        raise BadRequest(f'Unknown feature table: {name}')
+    return pool.read_table(name)
+
+
+def basic_information(fields=None):
+    """
+        :return: DataFrame，列为 field, Type, Token, TTR
+    """
+    df = load_table('basic_information')
+    if fields is not None:
+        df = df.loc[[_field(field) for field in _list(fields, 'fields')]]
+    return df.rename_axis('field').reset_index()
+
+
+QUERIES = {
+    'word': word,
+    'word_frequencies': word_frequencies,
+    'collocations': collocations,
+    'keywords': keywords,
+    'sentences': sentences,
+    'feature_table': feature_table,
+    'basic_information': basic_information,
+}
+
+
+def run(query, params=None):
+    """
+        按名字调用查询
+        :param query: QUERIES中的名字
+        :param params: 关键字参数
+        :return: DataFrame，或 (DataFrame, total)
+        :raise BadRequest: 查询名或参数不正确
+    """
+    if not isinstance(query, str) or query not in QUERIES:
+        raise BadRequest(f'Unknown query: {query}')
+    if params is None:
+        params = {}
+    if not isinstance(params, dict):
+        raise BadRequest(f'params must be an object: {params!r}')
+    function = QUERIES[query]
+    try:
+        inspect.signature(function).bind(**params)
+    except TypeError as e:
+        raise BadRequest(f'{query}: {e}') from None
+    return function(**params)
+
+
+def run_batch(requests):
+    """
+        同时执行多个查询
+        :param requests: [{'query': 名字, 'params': {...}}]
+        :return: 与requests顺序相同的结果列表；出错的查询返回对应的异常
+    """
+    def call(request):
+        try:
+            if not isinstance(request, dict):
+                raise BadRequest(f'A request must be an object: {request!r}')
+            return run(request.get('query'), request.get('params'))
+        except Exception as e:
+            return e
+
+    return list(_batch.map(call, requests))
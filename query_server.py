@@ -0,0 +1,112 @@
+"""
+    Local HTTP/JSON service for the lookups in queries.py.
+
+    POST /query   {"query": "collocations", "params": {"field": "History", "word": "war", "n": 2}}
+    POST /batch   [{"query": ..., "params": ...}, ...]   (run concurrently, answered in order)
+    GET  /queries the available queries
+    GET  /metrics (Prometheus text format) and /metrics.json: the timing spans of diagnostics.py
+
+    A result is {"rows": [...]} (plus "total" for paged queries); a failed query is {"error": "...",
+    "status": ...}: 400 for a bad query or parameters (do not retry), 500 for a failure of the server
+    such as a database or file error (may succeed when retried). /query answers with the same status.
+    The server is threaded and runs in one process, so all requests share the data cache and the
+    read-only connection pool of queries.py.
+
+    Usage:
+        python query_server.py [--host 127.0.0.1] [--port 8765]
+"""
+import json
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import diagnostics
+import queries
+
+MAX_BODY = 16 * 1024 * 1024
+
+
+def status_of(result):
+    """
+        :return: HTTP状态码：参数错误（queries.BadRequest）为400，其他错误（数据库、文件、程序错误）为500
+    """
+    if not isinstance(result, Exception):
+        return 200
+    return 400 if isinstance(result, queries.BadRequest) else 500
+
+
+def to_json(result):
+    if isinstance(result, Exception):
+        return {'error': str(result), 'status': status_of(result)}
+    if isinstance(result, tuple):
+        df, total = result
+        return {'rows': json.loads(df.to_json(orient='records')), 'total': int(total)}
+    return {'rows': json.loads(result.to_json(orient='records'))}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            data = diagnostics.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif self.path == '/metrics.json':
+            self._send(200, diagnostics.snapshot())
+        elif self.path == '/queries':
+            self._send(200, {name: (function.__doc__ or '').strip() for name, function in queries.QUERIES.items()})
+        else:
+            self._send(404, {'error': f'Not found: {self.path}'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            self._send(413, {'error': 'Request too large'})
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b'null')
+        except ValueError as e:
+            self._send(400, {'error': f'Invalid JSON: {e}'})
+            return
+
+        if self.path == '/query' and isinstance(body, dict):
+            try:
+                with diagnostics.page_context('query_server'):
+                    result = queries.run(body.get('query'), body.get('params'))
+            except Exception as e:
+                result = e
+            self._send(status_of(result), to_json(result))
+        elif self.path == '/batch' and isinstance(body, list):
+            self._send(200, [to_json(result) for result in queries.run_batch(body)])
+        else:
+            self._send(404, {'error': f'Not found: {self.path}'})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host='127.0.0.1', port=8765):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    print(f'Serving on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the corpus lookups over HTTP/JSON')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    serve(args.host, args.port)
@@ -0,0 +1,376 @@
+"""
+    Prebuilt SQLite indexes in corpora_data.db for the search boxes.
+
+    word_index: word -> (field, pos_tag, count) for every field, clustered on the word so a lookup
+    across all fields is one point query instead of opening every _word_attribute.xlsx.
+
+    collocations_<field>: the rows of n_grams_<field> with integer n and frequency, indexed on
+    (n, frequency) and mirrored into a trigram FTS5 table, so substring matching, ranking and the
+    top-N limit all run inside SQLite.
+
+    collocation_scores_<field>: the association scores of those n-grams (see association.py), so
+    they can be ranked by PMI, log-likelihood, t-score or Dice instead of raw frequency.
+
+    sentences_fts: every sentence of the sentences_attribute workbooks with its book and field, in an
+    FTS5 table for token, phrase and prefix search ranked by bm25.
+
+    Usage (run again after the corpus files change):
+        python search_index.py
+"""
+import argparse
+import sqlite3
+import pandas as pd
+
+from columnar import FIELDS, load_table, sentence_sheet_names, load_sentence_sheet
+from db_pool import DB_PATH, enable_wal, fetch_frame
+
+MEASURES = ('pmi', 'log_likelihood', 't_score', 'dice')
+
+
+def has_table(connection, name):
+    row = connection.execute("select 1 from sqlite_master where type in ('table', 'view') and name = ?",
+                             (name,)).fetchone()
+    return row is not None
+
+
+def build_word_index(connection, fields=FIELDS, log=print):
+    """
+        根据每个领域的word_attribute建立全局词表索引
+        :param connection: 数据库连接
+        :param fields: 领域
+        :param log: 进度输出
+    """
+    connection.execute("drop table if exists word_index")
+    connection.execute("""
+        create table word_index (
+            word text not null,
+            field text not null,
+            pos_tag text not null,
+            count integer not null,
+            primary key (word, field, pos_tag)
+        ) without rowid
+    """)
+    for field in fields:
+        try:
+            df = load_table('word_attribute', field, columns=['word', 'pos_tag', 'count'])
+        except FileNotFoundError:
+            continue
+        df = df.dropna(subset=['word', 'pos_tag']).groupby(['word', 'pos_tag'], as_index=False)['count'].sum()
+        connection.executemany("insert into word_index (word, field, pos_tag, count) values (?, ?, ?, ?)",
+                               ((w, field, p, int(c)) for w, p, c in df.itertuples(index=False)))
+        log(f'word_index {field}: {len(df)} rows')
+    connection.commit()
+
+
+def collocation_table(field):
+    if field not in FIELDS:
+        raise ValueError(f'Unknown field: {field}')
+    return f'collocations_{field}'
+
+
+def score_table(field):
+    collocation_table(field)
+    return f'collocation_scores_{field}'
+
+
+def build_collocation_index(connection, fields=FIELDS, log=print):
+    """
+        把n_grams_<field>转换成类型正确的表，并建立(n, frequency)索引和trigram全文索引
+        :param connection: 数据库连接
+        :param fields: 领域
+        :param log: 进度输出
+    """
+    for field in fields:
+        source = f'n_grams_{field}'
+        if not has_table(connection, source):
+            continue
+        table = collocation_table(field)
+        connection.execute(f"drop table if exists {table}_fts")
+        connection.execute(f"drop table if exists {table}")
+        connection.execute(f"""
+            create table {table} (
+                id integer primary key,
+                ngram text not null,
+                n integer not null,
+                frequency integer not null
+            )
+        """)
+        # 原表第一行是表头（text），只保留数字的行
+        connection.execute(f"""
+            insert into {table} (ngram, n, frequency)
+            select field1, cast(field3 as integer), cast(field2 as integer) from {source}
+            where field1 is not null and trim(field2) glob '[0-9]*' and trim(field3) glob '[0-9]*'
+        """)
+        connection.execute(f"create index {table}_n_freq on {table} (n, frequency desc)")
+        connection.execute(f"create index {table}_ngram on {table} (ngram, n)")
+        connection.execute(f"create virtual table {table}_fts using fts5("
+                           f"ngram, content='{table}', content_rowid='id', tokenize='trigram')")
+        connection.execute(f"insert into {table}_fts (rowid, ngram) select id, ngram from {table}")
+        connection.commit()
+        log(f'{table}: {connection.execute(f"select count(*) from {table}").fetchone()[0]} rows')
+
+
+def update_word_index(connection, field, word_pos, sign=1):
+    """
+        增加或减去一本书的(词, 词性)统计
+        :param connection: 数据库连接
+        :param field: 领域
+        :param word_pos: Counter，键为(word, pos_tag)
+        :param sign: 1为增加一本书，-1为删除一本书
+    """
+    if not has_table(connection, 'word_index'):
+        return
+    rows = [(w, field, p, sign * c) for (w, p), c in word_pos.items()]
+    connection.executemany("""
+        insert into word_index (word, field, pos_tag, count) values (?, ?, ?, ?)
+        on conflict (word, field, pos_tag) do update set count = count + excluded.count
+    """, rows)
+    if sign < 0:
+        connection.executemany("delete from word_index where word = ? and field = ? and pos_tag = ? and count <= 0",
+                               [row[:3] for row in rows])
+    connection.commit()
+
+
+def update_ngrams(connection, field, n_grams, sign=1):
+    """
+        增加或减去一本书的n元组统计，同时更新n_grams_<field>和collocations_<field>
+        :param connection: 数据库连接
+        :param field: 领域
+        :param n_grams: Counter，键为(n元组, n)
+        :param sign: 1为增加一本书，-1为删除一本书
+    """
+    table = collocation_table(field)
+    source = f'n_grams_{field}'
+    if not has_table(connection, source):
+        connection.execute(f"create table {source} (field1 text, field2 integer, field3 integer)")
+    connection.execute(f"create index if not exists {source}_key on {source} (field1, field3)")
+    indexed = has_table(connection, table)
+    fts = indexed and has_table(connection, f'{table}_fts')
+
+    for (text, n), count in n_grams.items():
+        delta = sign * count
+        cursor = connection.execute(f"update {source} set field2 = cast(field2 as integer) + ? "
+                                    f"where field1 = ? and cast(field3 as integer) = ?", (delta, text, n))
+        if cursor.rowcount == 0 and delta > 0:
+            connection.execute(f"insert into {source} (field1, field2, field3) values (?, ?, ?)", (text, delta, n))
+        elif delta < 0:
+            connection.execute(f"delete from {source} where field1 = ? and cast(field3 as integer) = ? "
+                               f"and cast(field2 as integer) <= 0", (text, n))
+        if not indexed:
+            continue
+        row = connection.execute(f"select id, frequency from {table} where ngram = ? and n = ?", (text, n)).fetchone()
+        if row is None:
+            if delta > 0:
+                rowid = connection.execute(f"insert into {table} (ngram, n, frequency) values (?, ?, ?)",
+                                           (text, n, delta)).lastrowid
+                if fts:
+                    connection.execute(f"insert into {table}_fts (rowid, ngram) values (?, ?)", (rowid, text))
+        elif row[1] + delta > 0:
+            connection.execute(f"update {table} set frequency = ? where id = ?", (row[1] + delta, row[0]))
+        else:
+            connection.execute(f"delete from {table} where id = ?", (row[0],))
+            if fts:
+                connection.execute(f"insert into {table}_fts ({table}_fts, rowid, ngram) values ('delete', ?, ?)",
+                                   (row[0], text))
+    connection.commit()
+
+
+def _like_pattern(word):
+    return '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def top_collocations(connection, field, word, n, top, measure='frequency', min_frequency=1):
+    """
+        查询包含word的n元组中频率（或关联度）最高的top个（不区分大小写的子串匹配）
+        :param connection: 数据库连接
+        :param field: 领域
+        :param word: 要查询的词
+        :param n: 词组长度
+        :param top: 返回的个数
+        :param measure: 'frequency' 或 MEASURES 之一；还没有计算关联度时按频率排序
+        :param min_frequency: 按关联度排序时忽略频率低于此值的n元组（PMI等偏向罕见的组合）；
+                              没有关联度（含有词表中没有的词）的n元组也不返回
+        :return: DataFrame，列为 Collocations, Frequency（按关联度排序时还有 Score），从高到低
+    """
+    if measure != 'frequency' and measure not in MEASURES:
+        raise ValueError(f'Unknown measure: {measure}')
+    table = collocation_table(field)
+    scores = score_table(field)
+    params = (int(n), int(top))
+    if measure in MEASURES and has_table(connection, table) and has_table(connection, scores):
+        if len(word) >= 3 and has_table(connection, f'{table}_fts'):
+            sql = f"""
+                select c.ngram, c.frequency, s.{measure} from {table}_fts f
+                join {table} c on c.id = f.rowid join {scores} s on s.id = c.id
+                where {table}_fts match ? and c.n = ? and c.frequency >= ? and s.{measure} is not null
+                order by s.{measure} desc limit ?
+            """
+            params = ('ngram : "' + word.replace('"', '""') + '"', int(n), int(min_frequency), int(top))
+        else:
+            # 沿(n, measure)索引按关联度顺序扫描
+            sql = f"""
+                select c.ngram, c.frequency, s.{measure} from {scores} s join {table} c on c.id = s.id
+                where s.n = ? and s.{measure} is not null and c.ngram like ? escape '\\' and c.frequency >= ?
+                order by s.{measure} desc limit ?
+            """
+            params = (int(n), _like_pattern(word), int(min_frequency), int(top))
+        df = fetch_frame(connection.execute(sql, params))
+        df.columns = ['Collocations', 'Frequency', 'Score']
+        return df.astype({'Frequency': int, 'Score': float})
+    if not has_table(connection, table):
+        # 还没有建立索引时直接查询原表
+        sql = f"""
+            select field1, cast(field2 as integer) as freq from n_grams_{field}
+            where cast(field3 as integer) = ? and trim(field2) glob '[0-9]*' and field1 like ? escape '\\'
+            order by freq desc limit ?
+        """
+        params = (int(n), _like_pattern(word), int(top))
+    elif len(word) >= 3 and has_table(connection, f'{table}_fts'):
+        sql = f"""
+            select c.ngram, c.frequency from {table}_fts f join {table} c on c.id = f.rowid
+            where {table}_fts match ? and c.n = ? order by c.frequency desc limit ?
+        """
+        params = ('ngram : "' + word.replace('"', '""') + '"',) + params
+    else:
+        # trigram索引不支持少于3个字符的查询，沿(n, frequency)索引按频率顺序扫描
+        sql = f"""
+            select ngram, frequency from {table}
+            where n = ? and ngram like ? escape '\\' order by frequency desc limit ?
+        """
+        params = (int(n), _like_pattern(word), int(top))
+    df = fetch_frame(connection.execute(sql, params))
+    df.columns = ['Collocations', 'Frequency']
+    return df.astype({'Frequency': int})
+
+
+def build_sentence_index(connection, fields=FIELDS, log=print):
+    """
+        为所有书的句子建立全文索引
+        :param connection: 数据库连接
+        :param fields: 领域
+        :param log: 进度输出
+    """
+    connection.execute("drop table if exists sentences_fts")
+    connection.execute("create virtual table sentences_fts using fts5("
+                       "sentences, tagged unindexed, book unindexed, field unindexed, tokenize='unicode61')")
+    for field in fields:
+        try:
+            sheet_names = sentence_sheet_names(field)
+        except FileNotFoundError:
+            continue
+        total = 0
+        for sheet_name in sheet_names:
+            df = load_sentence_sheet(field, sheet_name)
+            if 'tagged' not in df.columns:
+                df['tagged'] = None
+            df = df.dropna(subset=['sentences'])
+            connection.executemany("insert into sentences_fts (sentences, tagged, book, field) values (?, ?, ?, ?)",
+                                   ((sen, tagged, sheet_name, field)
+                                    for sen, tagged in zip(df['sentences'], df['tagged'])))
+            total += len(df)
+        connection.commit()
+        log(f'sentences_fts {field}: {total} sentences')
+
+
+def add_sentences(connection, field, book, sentences):
+    """
+        把一本书的句子加入全文索引
+        :param sentences: [(sentence, tagged, ...)]
+    """
+    if not has_table(connection, 'sentences_fts'):
+        return
+    connection.executemany("insert into sentences_fts (sentences, tagged, book, field) values (?, ?, ?, ?)",
+                           ((row[0], row[1], book, field) for row in sentences))
+    connection.commit()
+
+
+def remove_sentences(connection, field, book):
+    if not has_table(connection, 'sentences_fts'):
+        return
+    connection.execute("delete from sentences_fts where book = ? and field = ?", (book, field))
+    connection.commit()
+
+
+def fts_query(text, mode='token'):
+    """
+        把用户输入转换成FTS5查询
+        :param text: 用户输入
+        :param mode: token（包含所有词）, phrase（连续的词组）, prefix（以这些词开头的词）
+        :return: FTS5查询字符串，没有可查询的词时返回None
+    """
+    terms = [t.replace('"', '""') for t in text.split()]
+    if not terms:
+        return None
+    if mode == 'phrase':
+        return '"' + ' '.join(terms) + '"'
+    if mode == 'prefix':
+        return ' '.join(f'"{t}"*' for t in terms)
+    return ' '.join(f'"{t}"' for t in terms)
+
+
+def search_sentences(connection, text, mode='token', field=None, books=None, page=0, page_size=50):
+    """
+        在句子全文索引中查询，结果按相关度排序并分页
+        :param connection: 数据库连接
+        :param text: 查询内容
+        :param mode: 见fts_query
+        :param field: 只查询这个领域，None表示所有领域
+        :param books: 只查询这些书（工作表名），None表示所有书
+        :param page: 页码，从0开始
+        :param page_size: 每页的句子数
+        :return: (DataFrame，列为 sentences, tagged, book, field；符合条件的句子总数)
+    """
+    columns = ['sentences', 'tagged', 'book', 'field']
+    query = fts_query(text, mode)
+    if query is None:
+        return pd.DataFrame(columns=columns), 0
+
+    where = "sentences_fts match ?"
+    params = [query]
+    if field is not None:
+        where += " and field = ?"
+        params.append(field)
+    if books is not None:
+        books = list(books)
+        if not books:
+            return pd.DataFrame(columns=columns), 0
+        where += f" and book in ({', '.join('?' * len(books))})"
+        params += books
+
+    total = connection.execute(f"select count(*) from sentences_fts where {where}", params).fetchone()[0]
+    df = fetch_frame(connection.execute(f"select {', '.join(columns)} from sentences_fts where {where} "
+                                        f"order by rank limit ? offset ?",
+                                        params + [int(page_size), int(page) * int(page_size)]))
+    return df, total
+
+
+def lookup_word(connection, word, fields=None):
+    """
+        查询一个词在各领域中的词性和词频
+        :param connection: 数据库连接
+        :param word: 要查询的词
+        :param fields: 领域列表，None表示所有领域
+        :return: DataFrame，列为 word, pos_tag, count, field
+    """
+    sql = "select word, pos_tag, count, field from word_index where word = ?"
+    params = [word]
+    if fields is not None:
+        fields = list(fields)
+        if not fields:
+            return pd.DataFrame(columns=['word', 'pos_tag', 'count', 'field'])
+        sql += f" and field in ({', '.join('?' * len(fields))})"
+        params += fields
+    return fetch_frame(connection.execute(sql, params))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the search indexes in corpora_data.db')
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+    with sqlite3.connect(args.db) as conn:
+        enable_wal(conn)
+        build_word_index(conn)
+        build_collocation_index(conn)
+        from association import build_association_scores
+        build_association_scores(conn)
+        build_sentence_index(conn)
@@ -0,0 +1,208 @@
+"""
+    Corpus-scale spaCy analysis of the sentences of whole books.
+
+    analyse_books() streams every sentence of the given books through nlp.pipe (several processes,
+    configurable batch size) and stores one row of features per sentence in corpora_data.db:
+
+    sentence_features: field, book (sheet name), sentence_id (row of the sheet), tokens (without
+    punctuation), entities, dep_distance (sum of |head - token| over the dependency arcs), arcs and depth
+    (longest path from the root of the parse tree).
+
+    The views book_sentence_features and field_sentence_features aggregate them into entity density
+    (entities per 100 tokens), mean dependency distance and mean tree depth per book and per field.
+
+    start_job() runs the same analysis for some books of a field in a separate process, so the
+    Sentence page is not blocked while spaCy works; job_status() reports how it went.
+
+    Usage:
+        python sentence_features.py [--fields Business History] [--processes N] [--batch-size 256]
+        python sentence_features.py --fields History --books <sheet> <sheet> ...
+"""
+import os
+import sys
+import sqlite3
+import argparse
+import subprocess
+import threading
+
+from columnar import FIELDS, sentence_sheet_names
+from db_pool import DB_PATH, enable_wal
+from search_index import has_table
+from sentence_store import load_book
+
+SPACY_MODEL = os.environ.get('CORPUS_SPACY_MODEL', 'en_core_web_sm')
+BATCH_SIZE = 256
+JOB_LOG = os.path.join('.', 'corpus_build', 'sentence_features_{field}.log')
+
+_jobs = {}  # 领域 -> Popen
+_jobs_lock = threading.Lock()
+
+
+def create_tables(connection):
+    connection.execute("""
+        create table if not exists sentence_features (
+            field text, book text, sentence_id integer, tokens integer, entities integer,
+            dep_distance integer, arcs integer, depth integer,
+            primary key (field, book, sentence_id)
+        ) without rowid
+    """)
+    connection.execute("""
+        create view if not exists book_sentence_features as
+        select field, book, count(*) as sentences, sum(tokens) as tokens,
+               100.0 * sum(entities) / max(sum(tokens), 1) as entity_density,
+               1.0 * sum(dep_distance) / max(sum(arcs), 1) as mean_dependency_distance,
+               avg(depth) as mean_depth, 1.0 * sum(tokens) / count(*) as mean_sentence_length
+        from sentence_features group by field, book
+    """)
+    connection.execute("""
+        create view if not exists field_sentence_features as
+        select field, count(distinct book) as books, count(*) as sentences, sum(tokens) as tokens,
+               100.0 * sum(entities) / max(sum(tokens), 1) as entity_density,
+               1.0 * sum(dep_distance) / max(sum(arcs), 1) as mean_dependency_distance,
+               avg(depth) as mean_depth, 1.0 * sum(tokens) / count(*) as mean_sentence_length
+        from sentence_features group by field
+    """)
+
+
+def doc_features(doc):
+    """
+        :return: (tokens, entities, dep_distance, arcs, depth)
+    """
+    tokens = 0
+    dep_distance = 0
+    arcs = 0
+    depth = 0
+    depths = {}
+    for token in doc:
+        if token.is_punct or token.is_space:
+            continue
+        tokens += 1
+        if token.head.i != token.i:
+            dep_distance += abs(token.head.i - token.i)
+            arcs += 1
+        # 沿head向上数到根；记住走过的token的深度
+        path = []
+        node = token
+        while node.i not in depths and node.head.i != node.i:
+            path.append(node)
+            node = node.head
+        level = depths.get(node.i, 0)
+        for node in reversed(path):
+            level += 1
+            depths[node.i] = level
+        depth = max(depth, depths.get(token.i, 0))
+    return tokens, len(doc.ents), dep_distance, arcs, depth
+
+
+def _sentences(books):
+    for field, book in books:
+        df = load_book(field, book)
+        for sentence_id, sentence in enumerate(df['sentences']):
+            if isinstance(sentence, str) and sentence.strip():
+                yield sentence, (field, book, sentence_id)
+
+
+def analyse_books(connection, books, processes=1, batch_size=BATCH_SIZE, model=SPACY_MODEL, log=print):
+    """
+        分析这些书的所有句子，结果写入sentence_features（已有的结果会被替换）
+        :param connection: 可写的数据库连接
+        :param books: [(领域, 工作表名)]
+        :param processes: spaCy的进程数
+        :param batch_size: 每批的句子数
+    """
+    import spacy
+
+    create_tables(connection)
+    books = list(books)
+    for field, book in books:
+        remove_book(connection, field, book)
+    nlp = spacy.load(model, disable=['lemmatizer'])
+    rows = []
+    total = 0
+    for doc, (field, book, sentence_id) in nlp.pipe(_sentences(books), as_tuples=True,
+                                                     n_process=processes, batch_size=batch_size):
+        rows.append((field, book, sentence_id) + doc_features(doc))
+        if len(rows) >= batch_size * 8:
+            connection.executemany("insert into sentence_features values (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            connection.commit()
+            total += len(rows)
+            log(f'{total} sentences analysed')
+            rows = []
+    connection.executemany("insert into sentence_features values (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    connection.commit()
+    log(f'{total + len(rows)} sentences of {len(books)} books analysed')
+
+
+def remove_book(connection, field, book):
+    if not has_table(connection, 'sentence_features'):
+        return
+    connection.execute("delete from sentence_features where field = ? and book = ?", (field, book))
+    connection.commit()
+
+
+def start_job(field, books, processes=None):
+    """
+        在单独的进程中分析一个领域的这些书
+        :param books: 工作表名列表
+        :param processes: spaCy的进程数，None时使用所有CPU
+        :return: 是否启动了（这个领域已有任务在运行时不再启动）
+    """
+    if not books:
+        raise ValueError(f'No books of {field} to analyse')
+    with _jobs_lock:
+        job = _jobs.get(field)
+        if job is not None and job.poll() is None:
+            return False
+        log = JOB_LOG.format(field=field)
+        os.makedirs(os.path.dirname(log), exist_ok=True)
+        command = [sys.executable, os.path.abspath(__file__), '--fields', field, '--books', *books]
+        if processes:
+            command += ['--processes', str(processes)]
+        with open(log, 'w', encoding='utf-8') as output:
+            _jobs[field] = subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT)
+        return True
+
+
+def job_status(field):
+    """
+        :return: None（没有任务），'running'，'done' 或 'failed'，以及日志的最后一行
+    """
+    with _jobs_lock:
+        job = _jobs.get(field)
+    if job is None:
+        return None, ''
+    log = JOB_LOG.format(field=field)
+    last = ''
+    if os.path.exists(log):
+        with open(log, encoding='utf-8', errors='replace') as f:
+            lines = [line.strip() for line in f if line.strip()]
+        last = lines[-1] if lines else ''
+    code = job.poll()
+    return ('running' if code is None else 'done' if code == 0 else 'failed'), last
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Analyse every sentence of the corpus with spaCy')
+    parser.add_argument('--fields', nargs='*', default=FIELDS, choices=FIELDS)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--books', nargs='*', help='sheet names of the books to analyse (one field only)')
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db)
+    try:
+        enable_wal(conn)
+        if args.books is not None:
+            if len(args.fields) != 1:
+                parser.error('--books needs exactly one field')
+            targets = [(args.fields[0], sheet) for sheet in args.books]
+        else:
+            targets = []
+            for f in args.fields:
+                try:
+                    targets += [(f, sheet) for sheet in sentence_sheet_names(f)]
+                except FileNotFoundError:
+                    continue
+        analyse_books(conn, targets, args.processes, args.batch_size, log=lambda message: print(message, flush=True))
+    finally:
+        conn.close()
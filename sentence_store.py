@@ -0,0 +1,71 @@
+"""
+    Per-book access to the sentences_attribute workbooks.
+
+    Books are identified by their title (the file name under .\\book without .txt). book_sheets() maps
+    each title to its sheet once, and load_books() reads only the selected books: from their columnar
+    files when `python columnar.py` has been run, otherwise by parsing the workbook a single time for
+    all of its sheets. Everything read goes through the shared data cache.
+"""
+import re
+import pandas as pd
+
+from columnar import SENTENCES_XLSX, sentence_sheet_names, sentence_sheet_path, load_sentence_sheet, \
+    load_sentence_workbook
+from data_cache import cache
+
+
+def _normalize(name):
+    # Excel sheet names are limited to 31 characters and cannot contain []:*?/\
+    return re.sub(r'[\[\]:*?/\\]', '', name).strip().lower()
+
+
+def book_sheets(field, titles):
+    """
+        找到每本书对应的工作表
+        :param field: 领域
+        :param titles: 书名列表
+        :return: {书名: 工作表名}，找不到工作表的书不在其中
+    """
+    sheets = sentence_sheet_names(field)
+    normalized = {sheet: _normalize(sheet) for sheet in sheets}
+    mapping = {}
+    for title in titles:
+        key = _normalize(title)
+        exact = [sheet for sheet, name in normalized.items() if name == key]
+        # 工作表名被截断时，取与书名前缀重合最长的工作表
+        prefix = sorted((sheet for sheet, name in normalized.items() if name and key.startswith(name)),
+                        key=lambda sheet: len(normalized[sheet]), reverse=True)
+        # 兼容旧的匹配方式（书名前20个字符出现在工作表名中）
+        legacy = [sheet for sheet in sheets if title[:20] in sheet]
+        for candidates in (exact, prefix, legacy):
+            if candidates:
+                mapping[title] = candidates[0]
+                break
+    return mapping
+
+
+def load_book(field, sheet_name):
+    """
+        读取一本书的句子
+        :param field: 领域
+        :param sheet_name: 工作表名（book_sheets的结果）
+        :return: DataFrame（共享对象，调用方不要原地修改）
+    """
+    path = sentence_sheet_path(field, sheet_name)
+    if path != SENTENCES_XLSX.format(field=field):
+        return cache.get(path, lambda: load_sentence_sheet(field, sheet_name))
+    workbook = cache.get(path, lambda: load_sentence_workbook(field))
+    return workbook[workbook.book == sheet_name].drop(columns='book')
+
+
+def load_books(field, sheet_names):
+    """
+        读取多本书的句子并合并
+        :param field: 领域
+        :param sheet_names: 工作表名列表
+        :return: DataFrame，多了一列book
+    """
+    frames = [load_book(field, sheet_name).assign(book=sheet_name) for sheet_name in sheet_names]
+    if not frames:
+        return pd.DataFrame(columns=['sentences', 'tagged', 'book'])
+    return pd.concat(frames, ignore_index=True)
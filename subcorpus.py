@@ -0,0 +1,191 @@
+"""
+    Word and POS counts of every book, for statistics over any combination of books.
+
+    counts is a sparse CSR matrix with one row per book and one column per integer-coded word (the
+    transpose of a vocabulary x book matrix, stored this way so selecting books is a row slice), and
+    pos is a dense book x POS-tag matrix. The statistics of a user-chosen set of books are one sum over
+    the selected rows.
+
+    Built by preprocess.py into .\\corpus_build (counts.npz and counts.json) and kept up to date when
+    books are added or removed.
+"""
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+BUILD_DIR = os.path.join('.', 'corpus_build')
+COUNTS_NPZ = os.path.join(BUILD_DIR, 'counts.npz')
+COUNTS_META = os.path.join(BUILD_DIR, 'counts.json')
+
+
+class CountMatrix:
+    def __init__(self, books, vocab, tags, counts, pos):
+        self.books = list(books)  # [(field, title)]
+        self.vocab = list(vocab)
+        self.tags = list(tags)
+        self.counts = counts.tocsr()
+        self.pos = pos
+        self._word_ids = {word: i for i, word in enumerate(self.vocab)}
+        self._tag_ids = {tag: i for i, tag in enumerate(self.tags)}
+        self._book_ids = {book: i for i, book in enumerate(self.books)}
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], sparse.csr_matrix((0, 0), dtype=np.int64), np.zeros((0, 0), dtype=np.int64))
+
+    @classmethod
+    def from_partials(cls, partials):
+        """
+            :param partials: [(领域, 书名, 词频Counter, 词性Counter)]；同一本书出现多次时以最后一次为准
+        """
+        # 一次生成整个矩阵（逐本add_book每次都要复制已有的行）
+        latest = {}
+        for partial in partials:
+            latest.pop(partial[:2], None)
+            latest[partial[:2]] = partial
+        books, vocab, tags = [], [], []
+        word_ids, tag_ids = {}, {}
+        rows, cols, data = [], [], []
+        pos_rows, pos_cols, pos_data = [], [], []
+        for i, (field, title, words, pos) in enumerate(latest.values()):
+            books.append((field, title))
+            ids = cls._ids(list(words), word_ids, vocab)
+            rows.append(np.full(len(ids), i, dtype=np.int64))
+            cols.append(np.array(ids, dtype=np.int64))
+            data.append(np.fromiter(words.values(), dtype=np.int64, count=len(words)))
+            ids = cls._ids(list(pos), tag_ids, tags)
+            pos_rows += [i] * len(ids)
+            pos_cols += ids
+            pos_data += list(pos.values())
+        empty = np.zeros(0, dtype=np.int64)
+        counts = sparse.csr_matrix((np.concatenate(data or [empty]),
+                                    (np.concatenate(rows or [empty]), np.concatenate(cols or [empty]))),
+                                   shape=(len(books), len(vocab)))
+        pos_matrix = np.zeros((len(books), len(tags)), dtype=np.int64)
+        pos_matrix[pos_rows, pos_cols] = pos_data
+        return cls(books, vocab, tags, counts, pos_matrix)
+
+    @staticmethod
+    def _ids(keys, ids, names):
+        for key in keys:
+            if key not in ids:
+                ids[key] = len(names)
+                names.append(key)
+        return [ids[key] for key in keys]
+
+    def add_book(self, field, title, words, pos):
+        """
+            增加一本书（已经存在时替换）；用于增量更新，整个语料库用from_partials一次生成
+            :param words: 词频Counter
+            :param pos: 词性Counter
+        """
+        if (field, title) in self._book_ids:
+            self.remove_book(field, title)
+        word_ids = self._ids(list(words), self._word_ids, self.vocab)
+        tag_ids = self._ids(list(pos), self._tag_ids, self.tags)
+
+        row = sparse.csr_matrix((np.fromiter(words.values(), dtype=np.int64, count=len(words)),
+                                 (np.zeros(len(words), dtype=np.int64), np.array(word_ids, dtype=np.int64))),
+                                shape=(1, len(self.vocab)))
+        counts = self.counts.copy()
+        counts.resize((counts.shape[0], len(self.vocab)))
+        self.counts = sparse.vstack([counts, row], format='csr')
+
+        pos_row = np.zeros((1, len(self.tags)), dtype=np.int64)
+        pos_row[0, tag_ids] = list(pos.values())
+        old = np.zeros((self.pos.shape[0], len(self.tags)), dtype=np.int64)
+        old[:, :self.pos.shape[1]] = self.pos
+        self.pos = np.vstack([old, pos_row])
+
+        self._book_ids[(field, title)] = len(self.books)
+        self.books.append((field, title))
+
+    def remove_book(self, field, title):
+        index = self._book_ids.pop((field, title), None)
+        if index is None:
+            return
+        keep = np.arange(len(self.books)) != index
+        self.counts = self.counts[keep]
+        self.pos = self.pos[keep]
+        del self.books[index]
+        self._book_ids = {book: i for i, book in enumerate(self.books)}
+
+    def rows(self, books):
+        return [self._book_ids[book] for book in books if book in self._book_ids]
+
+    def word_counts(self, books):
+        """
+            :param books: [(领域, 书名)]
+            :return: 每个词的频数（按词编号）
+        """
+        return np.asarray(self.counts[self.rows(books)].sum(axis=0)).ravel()
+
+    def word_freq(self, books):
+        """
+            :return: DataFrame，列为 word, freq, word_lengths，按频数从高到低
+        """
+        counts = self.word_counts(books)
+        ids = np.flatnonzero(counts)
+        ids = ids[np.argsort(-counts[ids], kind='stable')]
+        words = np.array(self.vocab, dtype=object)[ids]
+        df = pd.DataFrame({'word': words, 'freq': counts[ids]})
+        df['word_lengths'] = df['word'].str.len()
+        return df
+
+    def basic_information(self, books):
+        counts = self.word_counts(books)
+        types = int(np.count_nonzero(counts))
+        tokens = int(counts.sum())
+        return {'Type': types, 'Token': tokens, 'TTR': types / tokens if tokens else 0.0}
+
+    def pos_proportion(self, books):
+        """
+            :return: DataFrame，列为 pos_tag, count, percentage(%)
+        """
+        counts = self.pos[self.rows(books)].sum(axis=0) if len(self.tags) else np.zeros(0, dtype=np.int64)
+        df = pd.DataFrame({'pos_tag': self.tags, 'count': counts})
+        df = df[df['count'] > 0].sort_values('count', ascending=False, ignore_index=True)
+        df['percentage(%)'] = df['count'] / max(df['count'].sum(), 1) * 100
+        return df
+
+    def cumulative_word_frequency(self, books):
+        df = self.word_freq(books)[['word', 'freq']]
+        df['cumulative_freq'] = df['freq'].cumsum()
+        return df
+
+    def save(self, npz=COUNTS_NPZ, meta=COUNTS_META):
+        os.makedirs(os.path.dirname(npz), exist_ok=True)
+        sparse.save_npz(npz + '.tmp.npz', self.counts)
+        with open(meta + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'books': self.books, 'vocab': self.vocab, 'tags': self.tags, 'pos': self.pos.tolist()},
+                      f, ensure_ascii=False)
+        os.replace(npz + '.tmp.npz', npz)
+        os.replace(meta + '.tmp', meta)
+
+    @classmethod
+    def load(cls, npz=COUNTS_NPZ, meta=COUNTS_META):
+        with open(meta, encoding='utf-8') as f:
+            data = json.load(f)
+        pos = np.array(data['pos'], dtype=np.int64).reshape(len(data['books']), len(data['tags']))
+        return cls([tuple(book) for book in data['books']], data['vocab'], data['tags'], sparse.load_npz(npz), pos)
+
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def load_matrix():
+    """
+        进程内共享的CountMatrix，文件更新后重新读取；还没有生成时返回None
+    """
+    if not os.path.exists(COUNTS_NPZ) or not os.path.exists(COUNTS_META):
+        return None
+    mtime = os.path.getmtime(COUNTS_META)
+    with _lock:
+        if _loaded.get('mtime') != mtime:
+            _loaded['matrix'] = CountMatrix.load()
+            _loaded['mtime'] = mtime
+        return _loaded['matrix']
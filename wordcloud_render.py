@@ -0,0 +1,209 @@
+"""
+    On-demand word clouds.
+
+    A word cloud is described by its inputs: the fields or books it covers, an optional POS filter and
+    the stopwords to leave out. request() looks the PNG up in a memory cache and then in a disk cache
+    under .\\wordcloud_cache (both keyed on a hash of the inputs and bounded in size). On a miss it
+    hands the rendering to a background process pool and returns at once, so the page never waits on
+    the CPU-heavy layout; the PNG is served from the cache on a later rerun. A failed render is
+    remembered with its error, which the page shows, and is not submitted again until retry().
+
+    Limits: CORPUS_WORDCLOUD_MEMORY_MB (default 64) and CORPUS_WORDCLOUD_DISK_MB (default 256).
+"""
+import io
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import diagnostics
+
+CACHE_DIR = os.path.join('.', 'wordcloud_cache')
+STOPWORDS = os.path.join('.', 'stopwords.txt')
+MEMORY_LIMIT = int(float(os.environ.get('CORPUS_WORDCLOUD_MEMORY_MB', 64)) * 1024 * 1024)
+DISK_LIMIT = int(float(os.environ.get('CORPUS_WORDCLOUD_DISK_MB', 256)) * 1024 * 1024)
+MAX_WORDS = 200
+
+
+def render_png(freqs, width=800, height=600):
+    """
+        在后台进程中运行：根据词频生成词云PNG
+        :param freqs: {词: 频数}
+        :return: PNG bytes
+    """
+    import wordcloud
+
+    image = wordcloud.WordCloud(width=width, height=height, background_color='white', max_words=MAX_WORDS) \
+        .generate_from_frequencies(freqs).to_image()
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def read_stopwords(path=STOPWORDS):
+    with open(path, encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def cloud_key(**inputs):
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class WordCloudCache:
+    def __init__(self, memory_limit=MEMORY_LIMIT, disk_limit=DISK_LIMIT, cache_dir=CACHE_DIR, workers=None):
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self._memory = OrderedDict()  # key -> PNG bytes
+        self._memory_size = 0
+        self._pending = {}  # key -> Future
+        self._failed = {}  # key -> 错误信息
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.png')
+
+    def _remember(self, key, png):
+        # 调用时已持有self._lock
+        if key in self._memory:
+            return
+        self._memory[key] = png
+        self._memory_size += len(png)
+        while self._memory_size > self.memory_limit and self._memory:
+            _, old = self._memory.popitem(last=False)
+            self._memory_size -= len(old)
+
+    def _trim_disk(self):
+        # 在后台进程的回调线程中运行，多个回调同时完成时由self._lock保证只有一个在删除
+        with self._lock:
+            files = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.png'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    info = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((info.st_mtime, info.st_size, path))
+            files.sort()
+            size = sum(file_size for _, file_size, _ in files)
+            for _, file_size, path in files:
+                if size <= self.disk_limit:
+                    break
+                size -= file_size
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _store(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            error = future.exception()
+            if error is not None:
+                self._failed[key] = f'{type(error).__name__}: {error}'
+                return
+            png = future.result()
+            self._remember(key, png)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._disk_path(key)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(png)
+        os.replace(path + '.tmp', path)
+        self._trim_disk()
+
+    def get(self, key):
+        """
+            :return: 已缓存的PNG，没有时返回None
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    png = f.read()
+                os.utime(path)
+            except FileNotFoundError:
+                # 刚被_trim_disk删除
+                return None
+            with self._lock:
+                self._remember(key, png)
+            return png
+        return None
+
+    def request(self, key, freqs_factory):
+        """
+            取词云；还没有生成时提交给后台进程并返回None（生成失败过的不再提交，见failure）
+            :param key: cloud_key的结果
+            :param freqs_factory: 无参数函数，返回{词: 频数}（只在需要生成时调用）
+            :return: PNG bytes 或 None
+        """
+        png = self.get(key)
+        diagnostics.count('wordcloud_cache.miss' if png is None else 'wordcloud_cache.hit')
+        if png is not None:
+            return png
+        with self._lock:
+            if key in self._pending or key in self._failed:
+                return None
+        freqs = freqs_factory()
+        if not freqs:
+            return None
+        with self._lock:
+            if key in self._pending or key in self._failed:
+                return None
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers)
+            future = self._pool.submit(render_png, freqs)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._store(key, f))
+        return None
+
+    def pending(self, key):
+        with self._lock:
+            return key in self._pending
+
+    def failure(self, key):
+        """
+            :return: 生成失败时的错误信息，否则为None
+        """
+        with self._lock:
+            return self._failed.get(key)
+
+    def retry(self, key):
+        """
+            忘记失败的记录，下一次request重新生成
+        """
+        with self._lock:
+            self._failed.pop(key, None)
+
+
+cache = WordCloudCache()
+
+
+def top_freqs(words, counts, stopwords, limit=MAX_WORDS * 5):
+    """
+        去掉停用词后取频数最高的词
+        :param words: 词的序列
+        :param counts: 对应的频数
+        :return: {词: 频数}
+    """
+    words = np.asarray(words, dtype=object)
+    counts = np.asarray(counts)
+    freqs = {}
+    for i in np.argsort(-counts, kind='stable'):
+        if len(freqs) >= limit or counts[i] <= 0:
+            break
+        word = words[i]
+        if isinstance(word, str) and word.lower() not in stopwords:
+            freqs[word] = int(counts[i])
+    return freqs